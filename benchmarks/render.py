@@ -0,0 +1,213 @@
+"""Render pipeline benchmarks.
+
+Generates synthetic cards, frames and covers in a temp directory, times the render
+entry points and prints the results as JSON. Runs offline, no database or Discord
+connection is needed.
+
+    python benchmarks/render.py --iterations 20 --output before.json
+    python benchmarks/render.py --warm --backend process
+"""
+
+import argparse, asyncio, json, os, platform, random, resource, shutil, sys, tempfile, time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import numpy as np, psutil, PIL
+import functions as func
+
+from io import BytesIO
+from PIL import Image
+from typing import Any, Awaitable, Callable, Dict, List
+
+CARD_SIZE = (1080, 1920)
+ANIMATED_FRAMES = 12
+CARDS_PER_TIER = 4  # The first card of every tier is animated
+
+def synthetic_card(rng: np.random.Generator, animated: bool) -> List[Image.Image]:
+    """A smooth gradient with some grain, close enough to a photo for the encoder."""
+    y, x = np.mgrid[0:CARD_SIZE[1], 0:CARD_SIZE[0]].astype(np.float32)
+    base = rng.uniform(0, 255, 3).astype(np.float32)
+    grain = rng.normal(0, 6, (CARD_SIZE[1], CARD_SIZE[0], 3)).astype(np.float32)
+    frames = []
+    for i in range(ANIMATED_FRAMES if animated else 1):
+        shift = i * 12
+        pixels = np.stack([
+            (base[0] + x / 6 + shift) % 256,
+            (base[1] + y / 10 + shift) % 256,
+            (base[2] + (x + y) / 14) % 256
+        ], axis=-1) + grain
+        frames.append(Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB'))
+
+    return frames
+
+def synthetic_frame(color: tuple) -> Image.Image:
+    frame = Image.new('RGBA', CARD_SIZE, color + (255,))
+    frame.paste((0, 0, 0, 0), (40, 40, CARD_SIZE[0] - 40, CARD_SIZE[1] - 40))
+    return frame
+
+def save(frames: List[Image.Image], path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    frames[0].save(path, format="WEBP", save_all=len(frames) > 1, append_images=frames[1:], duration=100, loop=0, quality=90)
+
+def build_fixtures(root: str, seed: int) -> Dict[str, List[str]]:
+    """Write cards for every tier, every frame and the covers."""
+    rng = np.random.default_rng(seed)
+    card_ids: Dict[str, List[str]] = {}
+    next_id = 1
+    for tier in func.settings.TIERS_BASE:
+        card_ids[tier] = []
+        for i in range(CARDS_PER_TIER):
+            save(synthetic_card(rng, animated=i == 0), os.path.join(root, "images", tier, f"{next_id}.webp"))
+            card_ids[tier].append(str(next_id))
+            next_id += 1
+
+    colors = random.Random(seed)
+    for name in list(func.settings.TIERS_BASE) + list(func.settings.FRAMES_BASE):
+        save([synthetic_frame(tuple(colors.randint(0, 255) for _ in range(3)))], os.path.join(root, "frames", f"{name}.webp"))
+
+    for level in range(1, 4):
+        save([Image.new('RGB', CARD_SIZE, (30 * level, 30, 60))], os.path.join(root, "cover", f"level{level}.webp"))
+
+    return card_ids
+
+def percentile(samples: List[float], percent: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))]
+
+class Bench:
+    def __init__(self, iterations: int, warm: bool) -> None:
+        self.iterations: int = iterations
+        self.warm: bool = warm
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    def reset(self) -> None:
+        import iufi
+        from iufi import cache, render
+
+        cache.clear_caches()
+        render._tile_cache.clear()
+        iufi.TempCard._image_cache.clear()
+        iufi.TempCard._bytes_cache.clear()
+
+    async def run(self, name: str, fn: Callable[[], Awaitable[Any]]) -> None:
+        if self.warm:
+            await fn()
+
+        samples, size = [], 0
+        for _ in range(self.iterations):
+            if not self.warm:
+                self.reset()
+
+            start_time = time.perf_counter()
+            result = await fn()
+            samples.append((time.perf_counter() - start_time) * 1000)
+            size = output_size(result)
+
+        self.results[name] = {
+            "p50_ms": round(percentile(samples, 50), 2),
+            "p95_ms": round(percentile(samples, 95), 2),
+            "mean_ms": round(sum(samples) / len(samples), 2),
+            "bytes": size,
+            "rss_mb": round(psutil.Process().memory_info().rss / 1024 ** 2, 1),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        }
+
+def output_size(result: Any) -> int:
+    if isinstance(result, tuple):
+        result = result[0]
+
+    if hasattr(result, "getbuffer"):
+        return result.getbuffer().nbytes
+
+    return 0
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    import iufi
+    from iufi.render import GridCanvas, RENDER_EXECUTOR, prerender_cards
+
+    pool = iufi.CardPool
+    card_ids = build_fixtures(func.ROOT_DIR, args.seed)
+    cards: Dict[str, List[iufi.Card]] = {
+        tier: [pool.add_card(card_id, tier, owner_id=1) for card_id in ids]
+        for tier, ids in card_ids.items()
+    }
+    common, static = cards["common"], [card for tier_cards in cards.values() for card in tier_cards[1:]]
+    animated = [tier_cards[0] for tier_cards in cards.values()]
+    framed = static[-1]
+    framed._frame = next(iter(func.settings.FRAMES_BASE))
+
+    if args.prerender:
+        prerender_cards([(card._image_path(), card._frame_path(card.tier[1])) for card in pool._cards.values()])
+
+    frames = iufi.preload_frames(iufi.frame_paths(), iufi.frame_size_rates())
+    match_level = func.settings.MATCH_GAME_SETTINGS["3"]
+    board_slots = match_level["cards"] * 2
+    unowned = static[10:14]
+    for card in unowned:
+        card.owner_id = None
+
+    async def click_match_board():
+        board = GridCanvas(board_slots, match_level["elem_per_row"])
+        cover = await iufi.TempCard.cover(3).image()
+        await RENDER_EXECUTOR.run(board.update, {index: cover for index in range(board_slots)}, "interactive")
+        return BytesIO(await RENDER_EXECUTOR.run(board.update, {0: await static[0].image()}, "interactive"))
+
+    bench = Bench(args.iterations, args.warm)
+    await bench.run("card_image", lambda: static[0].image())
+    await bench.run("card_image_bytes", lambda: static[0].image_bytes())
+    await bench.run("card_image_bytes_framed", lambda: framed.image_bytes())
+    await bench.run("roll_3", lambda: iufi.gen_cards_view(static[:3]))
+    await bench.run("collection_6", lambda: iufi.gen_cards_view(static[3:8] + [None], profile="interactive"))
+    await bench.run("cardinfo_8", lambda: iufi.gen_cards_view(static[6:10] + unowned, 4, hide_image_if_no_owner=True))
+    await bench.run("match_board_l3", lambda: iufi.gen_cards_view([iufi.TempCard.cover(3)] * board_slots, match_level["elem_per_row"], profile="interactive"))
+    await bench.run("match_board_l3_click", click_match_board)
+    await bench.run("gif_grid_6", lambda: iufi.gen_cards_view(animated[:3] + static[:3]))
+    await bench.run("preview_frame", lambda: RENDER_EXECUTOR.run(common[3].preview_frame, framed._frame))
+
+    RENDER_EXECUTOR.shutdown()
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "numpy": np.__version__,
+            "backend": func.settings.RENDER_SETTINGS.get("backend", "thread"),
+            "iterations": args.iterations,
+            "warm": args.warm,
+            "prerender": args.prerender,
+            "seed": args.seed,
+            "frame_overlays": frames,
+            "cpus": os.cpu_count()
+        },
+        "cases": bench.results
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the card render pipeline.")
+    parser.add_argument("--iterations", type=int, default=10, help="Timed runs per case.")
+    parser.add_argument("--warm", action="store_true", help="Keep the render caches between runs instead of starting cold.")
+    parser.add_argument("--prerender", action="store_true", help="Build the mips and the on-disk render cache first.")
+    parser.add_argument("--backend", choices=["thread", "process"], default="thread", help="Render backend to use.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic fixtures.")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args()
+
+    os.chdir(ROOT_DIR)
+    func.settings.load()
+    func.settings.RENDER_SETTINGS = {**func.settings.RENDER_SETTINGS, "backend": args.backend, "prerender": False, "roll_prefetch": 0}
+
+    # Everything the pipeline writes or reads goes to the temp dir, paths are bound on import
+    temp_dir = tempfile.mkdtemp(prefix="iufi-bench-")
+    func.ROOT_DIR, func.CARDS_FOLDER = temp_dir, os.path.join(temp_dir, "images")
+    os.chdir(temp_dir)
+    try:
+        report = asyncio.run(main(args))
+    finally:
+        os.chdir(ROOT_DIR)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
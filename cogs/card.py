@@ -180,16 +180,10 @@ class Card(commands.Cog):
         """
         user = await func.get_user(ctx.author.id)
 
-        if not user["cards"]:
+        if not iufi.CardPool.count_owned_cards(ctx.author.id):
             return await ctx.reply(f"**{ctx.author.mention} you have no photocards.**", delete_after=5)
         
-        converted_cards: list[iufi.Card] = []
-
-        for card_id in user["cards"]:
-            card = iufi.CardPool.get_card(card_id)
-            if card:
-                converted_cards.append(card)
-
+        converted_cards: list[iufi.Card] = list(iufi.CardPool.get_owned_cards(ctx.author.id).values())
         card_ids = [card.id for card in converted_cards]
         candies = sum([card.cost for card in converted_cards])
                        
@@ -201,7 +195,7 @@ class Card(commands.Cog):
         await view.wait()
 
         if view.is_confirm:
-            if user["cards"] != card_ids:
+            if iufi.CardPool.get_owned_cards(ctx.author.id).keys() != set(card_ids):
                 return await ctx.reply(content="Your cards cannot be converted because there has been a change in your inventory.", ephemeral=True)
             
             for card in converted_cards:
@@ -235,22 +229,14 @@ class Card(commands.Cog):
         categories = [func.match_string(category.lower(), set(func.settings.TIERS_BASE.keys()) | {"notag"}) for category in category_list]
         len_categories = len(category_list)
 
-        if not user["cards"]:
+        if not iufi.CardPool.count_owned_cards(ctx.author.id):
             return await ctx.reply(f"**{ctx.author.mention} you have no photocards.**", delete_after=5)
         
-        converted_cards: list[iufi.Card] = []
-        for card_id in user["cards"]:
-            card = iufi.CardPool.get_card(card_id)
-            if card:
-                if len_categories == 1 and "notag" in categorys and not card.tag:
-                    converted_cards.append(card)
-
-                elif card.tier[1] in categories:
-                    if "notag" in categories:
-                        if not card.tag:
-                            converted_cards.append(card)
-                    else:
-                        converted_cards.append(card)
+        tiers = None if len_categories == 1 and "notag" in categorys else categories
+        converted_cards: list[iufi.Card] = [
+            card for card in iufi.CardPool.get_owned_cards(ctx.author.id, tiers).values()
+            if not ("notag" in categories and card.tag)
+        ]
 
         card_ids = [card.id for card in converted_cards]
         candies = sum([card.cost for card in converted_cards])
@@ -263,7 +249,7 @@ class Card(commands.Cog):
         await view.wait()
 
         if view.is_confirm:
-            if not all(elem in user["cards"] for elem in card_ids):
+            if any(card.owner_id != ctx.author.id for card in converted_cards):
                 return await ctx.reply(content="Your cards cannot be converted because there has been a change in your inventory.", ephemeral=True)
             
             for card in converted_cards:
@@ -1,4 +1,5 @@
 import discord, iufi, psutil, asyncio
+import functions as func
 
 from discord.ext import commands
 from views import DebugView
@@ -52,6 +53,46 @@ class Developer(commands.Cog):
             inline=True
         )
 
+        caches = "\n".join([
+            f"{cache.name:<6}: {len(cache)} ({formatBytes(cache.size)}/{formatBytes(cache.max_bytes, True)})\n"
+            f"        hit {cache.hit_rate}% | evict {cache.evictions}"
+            for cache in iufi.RENDER_CACHES
+        ] + [f"Frames: {len(iufi.FRAME_OVERLAYS)} ({formatBytes(iufi.FRAME_OVERLAYS.nbytes, True)})"])
+        embed.add_field(
+            name="Render Cache",
+            value=f"```{caches}```",
+            inline=True
+        )
+
+        users = func.USERS_BUFFER
+        embed.add_field(
+            name="User Cache",
+            value=f"```• Users:   {len(users)}/{users.max_entries}\n" \
+                  f"• Hit:     {users.hit_rate}%\n" \
+                  f"• Evict:   {users.evictions} | expire {users.expirations}\n" \
+                  f"• Pending: {func.USER_WRITES.pending} | {func.USER_WRITES.last_flush_ms}ms```",
+            inline=True
+        )
+
+        card_writes = func.CARD_WRITES
+        embed.add_field(
+            name="Card Writes",
+            value=f"```• Queued:  {len(card_writes)}\n" \
+                  f"• Flush:   {card_writes.last_flush_ms}ms\n" \
+                  f"• Retry:   {card_writes.retries} | error {card_writes.errors}```",
+            inline=True
+        )
+
+        executor = iufi.RENDER_EXECUTOR
+        embed.add_field(
+            name="Render Queue",
+            value=f"```• Workers:   {executor.workers}\n" \
+                  f"• Pending:   {executor.pending}/{executor.workers + executor.queue_size}\n" \
+                  f"• Completed: {executor.completed}\n" \
+                  f"• Rejected:  {executor.rejected}```",
+            inline=False
+        )
+
         await ctx.reply(embed=embed, view=DebugView(self.bot, ctx.author), ephemeral=True)
 
     async def _findsimilar(self, interaction: discord.Interaction, message: discord.Message):
@@ -49,6 +49,14 @@ class Gameplay(commands.Cog):
             
             query["$inc"] = {f"roll.{tier}": -1}
 
+        # Draw before charging, a roll that can not be filled raises and costs nothing
+        # Prefetched rolls use the base drop rates, so only plain rolls can take one
+        prefetched = None if tier or actived_potions.get("luck") else iufi.CardPool.take_prefetched_roll()
+        if prefetched:
+            cards, image_bytes = prefetched
+        else:
+            cards, image_bytes = iufi.CardPool.roll(included=[tier] if tier else None, luck_rates=None if tier else actived_potions.get("luck", None)), None
+
         query = func.update_quest_progress(user, "ROLL", query=query)
         await func.update_user(ctx.author.id, query)
         
@@ -57,8 +65,10 @@ class Gameplay(commands.Cog):
             view.add_item(discord.ui.Button(label='Beginner Guide', emoji='📗', url='https://docs.google.com/document/d/1VAD20wZQ56S_wDeMJlwIKn_jImIPuxh2lgy1fn17z0c/edit'))
             await ctx.reply(f"**Welcome to IUFI! Please have a look at the guide or use `qhelp` to begin.**", view=view)
 
-        cards = iufi.CardPool.roll(included=[tier] if tier else None, luck_rates=None if tier else actived_potions.get("luck", None))
-        image_bytes, image_format = await iufi.gen_cards_view(cards)
+        if image_bytes:
+            image_format = "webp"
+        else:
+            image_bytes, image_format = await iufi.gen_cards_view(cards)
 
         view = RollView(ctx.author, cards)
         view.message = await ctx.send(
@@ -15,17 +15,21 @@ class Listeners(commands.Cog):
             return
         
         user = await func.get_user(member.id, insert=False)
-        converted_cards: list[iufi.Card] = []
-        for card_id in user["cards"]:
-            card = iufi.CardPool.get_card(card_id)
-            if card and card.owner_id == member.id:
-                iufi.CardPool.add_available_card(card)
-                converted_cards.append(card)
-                
-        await func.update_user(member.id, {
-            "$pull": {"cards": {"$in": (card_ids := [card.id for card in converted_cards])}}
-        })
-        await func.update_card(card_ids, {"$set": {"owner_id": None, "tag": None, "frame": None}})
+        converted_cards: list[iufi.Card] = list(iufi.CardPool.get_owned_cards(member.id).values())
+        card_ids = [card.id for card in converted_cards]
+
+        # Listed ids the user no longer owns are cleared with the rest
+        stale_ids, _ = iufi.CardPool.check_owned_cards(member.id, user.get("cards", []) if user else [])
+
+        for card in converted_cards:
+            iufi.CardPool.add_available_card(card)
+
+        if card_ids or stale_ids:
+            await func.update_user(member.id, {
+                "$pull": {"cards": {"$in": card_ids + list(stale_ids)}}
+            })
+        if card_ids:
+            await func.update_card(card_ids, {"$set": {"owner_id": None, "tag": None, "frame": None}})
         
         func.logger.info(f"User {member.name}({member.id}) has been banned from {guild.name}({guild.id}). All their cards will be returned to the card pool.")
 
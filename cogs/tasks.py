@@ -65,20 +65,18 @@ class Tasks(commands.Cog):
         if user_id not in self.warned_users:
             return 0
         
-        converted_cards: list[iufi.Card] = []
-        for card_id in user["cards"]:
-            card = iufi.CardPool.get_card(card_id)
-            if card:
-                converted_cards.append(card)
-
+        converted_cards: list[iufi.Card] = list(iufi.CardPool.get_owned_cards(user_id).values())
         card_ids = [card.id for card in converted_cards]
         candies = sum([card.cost for card in converted_cards])
+
+        # Listed ids the user no longer owns are cleared with the rest
+        stale_ids, _ = iufi.CardPool.check_owned_cards(user_id, user.get("cards", []))
             
         for card in converted_cards:
             iufi.CardPool.add_available_card(card)
 
         await func.update_user(user_id, {
-            "$pull": {"cards": {"$in": card_ids}},
+            "$pull": {"cards": {"$in": card_ids + list(stale_ids)}},
             "$inc": {"candies": candies}
         })
         await func.update_card(card_ids, {"$set": {"owner_id": None, "tag": None, "frame": None, "last_trade_time": 0}})
@@ -155,7 +153,7 @@ class Tasks(commands.Cog):
                 channel = self.bot.get_channel(random.choice(func.settings.GAME_CHANNEL_IDS))
                 if channel:
                     view = DropView(cards[0])
-                    covered_card: iufi.TempCard = iufi.TempCard(f"cover/level{random.randint(1, 3)}.webp")
+                    covered_card: iufi.TempCard = iufi.TempCard.cover(random.randint(1, 3))
                     image_bytes, image_format = await covered_card.image_bytes(), covered_card.format
                     view.message = await channel.send(
                         content=f"**Hurry up! This claim ends in: <t:{round(time.time()) + 70}:R>**",
@@ -174,7 +172,7 @@ class Tasks(commands.Cog):
         await self.bot.wait_until_ready()
 
         try:
-            func.USERS_BUFFER.clear()
+            func.USERS_BUFFER.prune()
 
             # Syncing Question Data with Database
             for q in iufi.QuestionPool._questions:
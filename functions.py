@@ -1,5 +1,10 @@
-import os, time, copy, json, random, logging, discord
+import os, time, copy, json, random, asyncio, logging, discord
 
+from collections import OrderedDict
+from itertools import zip_longest
+from bson import encode
+from pymongo import IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
 from motor.motor_asyncio import (
     AsyncIOMotorClient,
     AsyncIOMotorCollection,
@@ -14,6 +19,9 @@ from typing import (
     List,
     Dict,
     Any,
+    Iterator,
+    TextIO,
+    Tuple,
     Union
 )
 
@@ -35,6 +43,10 @@ MUSIC_TRACKS_FOLDER = os.path.join(ROOT_DIR, 'musicTracks')
 if not os.path.exists(MUSIC_TRACKS_FOLDER):
     os.makedirs(MUSIC_TRACKS_FOLDER)
 
+JOURNAL_FOLDER = os.path.join(ROOT_DIR, 'journal')
+
+IndexKeys = List[Tuple[str, int]]  # (Field, direction) pairs of an index
+
 class TOKEN:
     def __init__(self) -> None:
         load_dotenv()
@@ -70,6 +82,8 @@ class Settings:
         self.RANK_BASE: Dict[Dict, Dict[str, Any]] = {}
         self.MATCH_GAME_SETTINGS: Dict[str, Dict[str, Any]] = {}
         self.MUSIC_GAME_SETTINGS: Dict[str, Any] = {}
+        self.RENDER_SETTINGS: Dict[str, Any] = {}
+        self.DATABASE_SETTINGS: Dict[str, Any] = {}
         self.ADMIN_IDS: List[int] = []
         self.BUG_REPORT_CHANNEL_ID: int = 0
         self.OPUS_PATH: str = ""
@@ -102,11 +116,508 @@ class Settings:
         self.RANK_BASE = settings.get("RANK_BASE")
         self.MATCH_GAME_SETTINGS = settings.get("MATCH_GAME_SETTINGS")
         self.MUSIC_GAME_SETTINGS = settings.get("MUSIC_GAME_SETTINGS")
+        self.RENDER_SETTINGS = settings.get("RENDER_SETTINGS", {})
+        self.DATABASE_SETTINGS = settings.get("DATABASE_SETTINGS", {})
         self.ADMIN_IDS = settings.get("ADMIN_IDS")
         self.BUG_REPORT_CHANNEL_ID = settings.get("BUG_REPORT_CHANNEL_ID")
         self.OPUS_PATH = settings.get("OPUS_PATH")
         self.LOGGING = settings.get("LOGGING", {})
 
+class UserCache:
+    """An LRU cache of user documents, bounded by entry count and idle time."""
+
+    def __init__(self) -> None:
+        self._entries: OrderedDict[int, Tuple[Dict[str, Any], float]] = OrderedDict()  # User id to (user, last access)
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.expirations: int = 0
+
+    @property
+    def max_entries(self) -> int:
+        return settings.DATABASE_SETTINGS.get("user_cache_size", 5000)
+
+    @property
+    def ttl(self) -> float:
+        return settings.DATABASE_SETTINGS.get("user_cache_ttl", 3600)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return round(self.hits / total * 100, 1) if total else 0.0
+
+    def get(self, user_id: int) -> Dict[str, Any] | None:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if time.time() - entry[1] > self.ttl:
+            del self._entries[user_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries[user_id] = (entry[0], time.time())
+        self._entries.move_to_end(user_id)
+        return entry[0]
+
+    def put(self, user_id: int, user: Dict[str, Any]) -> None:
+        self._entries[user_id] = (user, time.time())
+        self._entries.move_to_end(user_id)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, user_id: int) -> Dict[str, Any] | None:
+        entry = self._entries.pop(user_id, None)
+        return entry[0] if entry else None
+
+    def prune(self) -> int:
+        """Drop the entries that have been idle longer than the ttl."""
+        expired, threshold = 0, time.time() - self.ttl
+        while self._entries and next(iter(self._entries.values()))[1] < threshold:
+            self._entries.popitem(last=False)
+            expired += 1
+
+        self.expirations += expired
+        return expired
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def _overlaps(path: str, other: str) -> bool:
+    return path == other or path.startswith(other + ".") or other.startswith(path + ".")
+
+def merge_update(target: Dict[str, Any], data: Dict[str, Any]) -> bool:
+    """Merge the update document `data` into `target` in place.
+
+    Returns False and leaves `target` untouched when the two can not be combined into
+    a single update with the same result, e.g. a $set after a $push on the same field.
+    """
+    for mode, action in data.items():
+        for key, value in action.items():
+            for other_mode, other_action in target.items():
+                for other_key, other_value in other_action.items():
+                    if not _overlaps(key, other_key):
+                        continue
+
+                    if mode != other_mode or key != other_key:
+                        return False
+
+                    if mode == "$push" and not all(isinstance(v, dict) and v.keys() == {"$each"} or not isinstance(v, dict) for v in (value, other_value)):
+                        return False
+
+                    if mode == "$pull" and not all(isinstance(v, dict) and v.keys() == {"$in"} or not isinstance(v, dict) for v in (value, other_value)):
+                        return False
+
+    for mode, action in data.items():
+        merged = target.setdefault(mode, {})
+        for key, value in action.items():
+            if key not in merged or mode in ("$set", "$unset"):
+                merged[key] = value
+
+            elif mode == "$inc":
+                merged[key] += value
+
+            elif mode == "$push":
+                merged[key] = {"$each": [
+                    *(merged[key]["$each"] if isinstance(merged[key], dict) else [merged[key]]),
+                    *(value["$each"] if isinstance(value, dict) else [value])
+                ]}
+
+            elif mode == "$pull":
+                merged[key] = {"$in": [
+                    *(merged[key]["$in"] if isinstance(merged[key], dict) else [merged[key]]),
+                    *(value["$in"] if isinstance(value, dict) else [value])
+                ]}
+
+    return True
+
+# Write error codes worth retrying, the rest are logged and dropped
+TRANSIENT_WRITE_CODES = {6, 7, 50, 89, 91, 112, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+
+def split_write_errors(error: BulkWriteError) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, Dict[str, Any]]]:
+    """Split the write errors of a bulk write into transient and permanent ones, by request index."""
+    transient, permanent = {}, {}
+    for write_error in error.details.get("writeErrors", []):
+        (transient if write_error.get("code") in TRANSIENT_WRITE_CODES else permanent)[write_error["index"]] = write_error
+
+    return transient, permanent
+
+class UserWriteBuffer:
+    """Coalesces user updates in memory and writes them to Mongo in batches.
+
+    Every update is appended to a local journal with an increasing sequence number
+    before it is buffered. Flushed updates also raise `journal_seq` in the user
+    document to their sequence, and replay only applies an entry to a document whose
+    `journal_seq` is lower, so segments left behind by a crash can be replayed safely
+    even when part of them already reached Mongo.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Dict[int, List[Tuple[int, Dict[str, Any]]]] = {}  # User id to (sequence, update), oldest first
+        self._flushing: set[int] = set()
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+        self._journal: TextIO | None = None
+        self._segment: int = 0
+        self._first_segment: int = 0  # Older segments are left for the next replay
+        self._sequence: int = 0
+
+        self.flushes: int = 0
+        self.written: int = 0
+        self.dropped: int = 0
+        self.errors: int = 0
+        self.last_flush_ms: float = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.DATABASE_SETTINGS.get("write_behind", False)
+
+    @property
+    def interval(self) -> float:
+        return settings.DATABASE_SETTINGS.get("flush_interval_ms", 250) / 1000
+
+    @property
+    def batch_size(self) -> int:
+        return settings.DATABASE_SETTINGS.get("flush_batch_size", 500)
+
+    @property
+    def pending(self) -> int:
+        return sum(len(updates) for updates in self._pending.values())
+
+    def has_pending(self, user_id: int) -> bool:
+        return user_id in self._pending or user_id in self._flushing
+
+    def add(self, user_id: int, data: Dict[str, Any]) -> None:
+        data = copy.deepcopy(data)
+        # Wall clock based so sequences keep growing across restarts
+        self._sequence = sequence = max(self._sequence + 1, time.time_ns())
+        self._write_journal(user_id, sequence, data)
+
+        updates = self._pending.setdefault(user_id, [])
+        if updates and merge_update(updates[-1][1], data):
+            updates[-1] = (sequence, updates[-1][1])
+        else:
+            updates.append((sequence, data))
+
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+
+            pending, self._pending = self._pending, {}
+            self._flushing = set(pending)
+            segment = self._rotate_journal()
+
+            start_time = time.perf_counter()
+            # Each round holds at most one update per user, so the rounds keep every user's order
+            rounds = [
+                [(user_id, update) for user_id, update in batch if update is not None]
+                for batch in zip_longest(*([(user_id, update) for update in updates] for user_id, updates in pending.items()), fillvalue=(None, None))
+            ]
+            retry: Dict[int, List[Tuple[int, Dict[str, Any]]]] = {}  # Users whose remaining updates wait for the next flush
+            try:
+                for index, batch in enumerate(rounds):
+                    updates = []
+                    for user_id, update in batch:
+                        if user_id in retry:
+                            retry[user_id].append(update)
+                        else:
+                            updates.append((user_id, update))
+                    if not updates:
+                        continue
+
+                    try:
+                        await USERS_DB.bulk_write([
+                            UpdateOne({"_id": user_id}, data | {"$max": {"journal_seq": sequence}})
+                            for user_id, (sequence, data) in updates
+                        ], ordered=False)
+                    except BulkWriteError as e:
+                        self.errors += 1
+                        transient, permanent = split_write_errors(e)
+                        for request_index, write_error in permanent.items():
+                            self.dropped += 1
+                            logger.error(f"Dropped the update of user {updates[request_index][0]}: {updates[request_index][1][1]}. Reason: {write_error.get('errmsg')}")
+
+                        for request_index in transient:
+                            user_id, update = updates[request_index]
+                            retry[user_id] = [update]
+                        self.written += len(updates) - len(transient) - len(permanent)
+                        continue
+                    except ConnectionFailure:
+                        # Nothing is known to be applied, retried as is on the next flush
+                        self.errors += 1
+                        for user_id, update in updates + [item for later in rounds[index + 1:] for item in later]:
+                            retry.setdefault(user_id, []).append(update)
+                        raise
+
+                    self.written += len(updates)
+            finally:
+                self._flushing.clear()
+                self._requeue(retry)
+
+            self.flushes += 1
+            self.last_flush_ms = round((time.perf_counter() - start_time) * 1000, 2)
+            if not retry:
+                self._remove_segments(segment)
+
+    async def close(self) -> None:
+        if self._task:
+            # Taken so a flush already running finishes before the task is stopped
+            async with self._lock:
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        await self.flush()
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    async def replay(self) -> int:
+        """Apply the journal segments left behind by an unclean shutdown.
+
+        Entries whose sequence the user document already holds were written before the
+        crash and are skipped by the filter. The segments are kept when a transient error
+        leaves entries unapplied, so the next start replays them again.
+        """
+        segments = self._segments()
+        entries: Dict[int, List[UpdateOne]] = {}
+        for _, path in segments:
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # The last line of a crashed write
+
+                    entries.setdefault(entry["_id"], []).append(UpdateOne(
+                        {"_id": entry["_id"], "journal_seq": {"$not": {"$gte": entry["seq"]}}},
+                        entry["update"] | {"$max": {"journal_seq": entry["seq"]}}
+                    ))
+                    self._sequence = max(self._sequence, entry["seq"])
+
+        applied, failed = 0, set()
+        # One entry per user in each round, like flush, so every user's order is kept
+        for batch in zip_longest(*([(user_id, request) for request in requests] for user_id, requests in entries.items()), fillvalue=(None, None)):
+            requests = [(user_id, request) for user_id, request in batch if user_id is not None and user_id not in failed]
+            if not requests:
+                continue
+
+            try:
+                applied += (await USERS_DB.bulk_write([request for _, request in requests], ordered=False)).modified_count
+            except BulkWriteError as e:
+                transient, permanent = split_write_errors(e)
+                for request_index, write_error in permanent.items():
+                    self.dropped += 1
+                    logger.error(f"Dropped the journaled update of user {requests[request_index][0]}. Reason: {write_error.get('errmsg')}")
+
+                failed.update(requests[request_index][0] for request_index in transient)
+                applied += e.details.get("nModified", 0)
+
+        self._segment = self._first_segment = segments[-1][0] + 1 if segments else 0
+        if failed:
+            logger.warning(f"Unable to replay the journaled updates of {len(failed)} users, the journal is kept for the next start.")
+            return applied
+
+        for _, path in segments:
+            os.remove(path)
+
+        return applied
+
+    async def _run(self) -> None:
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Unable to flush the buffered user updates.", exc_info=e)
+
+    def _requeue(self, retry: Dict[int, List[Tuple[int, Dict[str, Any]]]]) -> None:
+        # Updates buffered during the flush go after the ones being retried
+        for user_id, updates in self._pending.items():
+            retry.setdefault(user_id, []).extend(updates)
+        self._pending = retry
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        if not os.path.isdir(JOURNAL_FOLDER):
+            return []
+
+        segments = []
+        for entry in os.scandir(JOURNAL_FOLDER):
+            name, ext = os.path.splitext(entry.name)
+            if ext == ".jsonl" and name.startswith("users-") and name[6:].isdigit():
+                segments.append((int(name[6:]), entry.path))
+
+        return sorted(segments)
+
+    def _write_journal(self, user_id: int, sequence: int, data: Dict[str, Any]) -> None:
+        if not settings.DATABASE_SETTINGS.get("journal", True):
+            return
+
+        if not self._journal:
+            os.makedirs(JOURNAL_FOLDER, exist_ok=True)
+            self._journal = open(os.path.join(JOURNAL_FOLDER, f"users-{self._segment}.jsonl"), "a", encoding="utf-8")
+
+        self._journal.write(json.dumps({"_id": user_id, "seq": sequence, "update": data}) + "\n")
+        self._journal.flush()
+
+    def _rotate_journal(self) -> int:
+        """Close the current segment and return its number, later updates go to a new one."""
+        if self._journal:
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+            self._journal = None
+
+        segment, self._segment = self._segment, self._segment + 1
+        return segment
+
+    def _remove_segments(self, last: int) -> None:
+        for segment, path in self._segments():
+            if self._first_segment <= segment <= last:
+                os.remove(path)
+
+class CardWriteQueue:
+    """Coalesces $set updates per card and writes them with one unordered bulk_write.
+
+    Later values for the same field replace earlier ones, so a card touched many times
+    between flushes costs a single update. Connection errors and transient write errors
+    are retried with backoff before the fields go back into the queue, permanent write
+    errors are logged and dropped so they do not fail every later flush.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Dict[str, Dict[str, Any]] = {}  # Card id to the fields to $set
+        self._task: asyncio.Task | None = None
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+        self.flushes: int = 0
+        self.written: int = 0
+        self.retries: int = 0
+        self.errors: int = 0
+        self.dropped: int = 0
+        self.last_flush_ms: float = 0.0
+
+    @property
+    def interval(self) -> float:
+        return settings.DATABASE_SETTINGS.get("flush_interval_ms", 250) / 1000
+
+    @property
+    def max_retries(self) -> int:
+        return settings.DATABASE_SETTINGS.get("card_write_retries", 3)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def set(self, card_id: str, fields: Dict[str, Any]) -> None:
+        self._pending.setdefault(card_id, {}).update(fields)
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+
+            pending, self._pending = self._pending, {}
+
+            start_time = time.perf_counter()
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    self.retries += 1
+                    await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+
+                updates = list(pending.items())
+                try:
+                    await CARDS_DB.bulk_write([UpdateOne({"_id": card_id}, {"$set": fields}) for card_id, fields in updates], ordered=False)
+                except BulkWriteError as e:
+                    self.errors += 1
+                    transient, permanent = split_write_errors(e)
+                    for index, write_error in permanent.items():
+                        self.dropped += 1
+                        logger.error(f"Dropped the update of card {updates[index][0]}: {updates[index][1]}. Reason: {write_error.get('errmsg')}")
+
+                    self.written += len(updates) - len(transient) - len(permanent)
+                    pending = {updates[index][0]: updates[index][1] for index in transient}
+                except ConnectionFailure:
+                    self.errors += 1
+                    if attempt == self.max_retries:
+                        self._requeue(pending)
+                        raise
+                except Exception:
+                    # Can not be sent at all, e.g. a value that does not encode, only those cards are dropped
+                    self.errors += 1
+                    pending = {}
+                    for card_id, fields in updates:
+                        try:
+                            encode({"$set": fields})
+                        except Exception as e:
+                            self.dropped += 1
+                            logger.error(f"Dropped the update of card {card_id}: {fields}. Reason: {e}")
+                        else:
+                            pending[card_id] = fields
+
+                    if len(pending) == len(updates):
+                        self._requeue(pending)
+                        raise
+                else:
+                    self.written += len(updates)
+                    pending = {}
+
+                if not pending:
+                    break
+            else:
+                logger.error(f"Requeued {len(pending)} card updates after {self.max_retries} retries.")
+                self._requeue(pending)
+
+            self.flushes += 1
+            self.last_flush_ms = round((time.perf_counter() - start_time) * 1000, 2)
+
+    async def close(self) -> None:
+        if self._task:
+            async with self._lock:
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        await self.flush()
+
+    async def _run(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Unable to flush the queued card updates.", exc_info=e)
+
+    def _requeue(self, pending: Dict[str, Dict[str, Any]]) -> None:
+        # Fields queued during the flush are newer and win
+        for card_id, fields in self._pending.items():
+            pending.setdefault(card_id, {}).update(fields)
+        self._pending = pending
+
 tokens: TOKEN = TOKEN()
 settings: Settings = Settings()
 logger: logging.Logger = logging.getLogger("iufi")
@@ -118,7 +629,10 @@ CARDS_DB: AsyncIOMotorCollection = None
 QUESTIONS_DB: AsyncIOMotorCollection = None
 MUSIC_DB: AsyncIOMotorCollection = None
 
-USERS_BUFFER: Dict[int, Dict[str, Any]] = {}
+USERS_BUFFER: UserCache = UserCache()
+USER_LOADS: Dict[int, asyncio.Task] = {}  # In-flight user loads, shared by concurrent callers
+USER_WRITES: UserWriteBuffer = UserWriteBuffer()
+CARD_WRITES: CardWriteQueue = CardWriteQueue()
 
 QUESTS_SETTINGS: Dict[str, Dict[str, int]] = {
     "daily": {
@@ -235,16 +749,39 @@ def match_string(input_string: str, word_list: List[str]) -> str:
 def truncate_string(text: str, length: int = 18) -> str:
     return text[:length - 3] + "..." if len(text) > length else text
 
-async def get_user(user_id: int, *, insert: bool = True) -> Dict[str, Any]:
-    user = USERS_BUFFER.get(user_id)
-    if not user:
+async def _load_user(user_id: int, insert: bool) -> Dict[str, Any]:
+    # The user was evicted with buffered updates, write them before reading the document back
+    if USER_WRITES.has_pending(user_id):
+        await USER_WRITES.flush()
+
+    if insert:
+        # Creates the user if needed and returns the stored document in one round-trip
+        user = await USERS_DB.find_one_and_update(
+            {"_id": user_id},
+            {"$setOnInsert": copy.deepcopy(settings.USER_BASE)},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    else:
         user = await USERS_DB.find_one({"_id": user_id})
-        if not user and insert:
-            await USERS_DB.insert_one({"_id": user_id, **settings.USER_BASE})
 
-        user = USERS_BUFFER[user_id] = user if user else copy.deepcopy(settings.USER_BASE) | {"_id": user_id}
+    user = user if user else copy.deepcopy(settings.USER_BASE) | {"_id": user_id}
+    USERS_BUFFER.put(user_id, user)
     return user
 
+async def get_user(user_id: int, *, insert: bool = True) -> Dict[str, Any]:
+    user = USERS_BUFFER.get(user_id)
+    if user:
+        return user
+
+    load = USER_LOADS.get(user_id)
+    if not load:
+        load = USER_LOADS[user_id] = asyncio.create_task(_load_user(user_id, insert))
+        load.add_done_callback(lambda _: USER_LOADS.pop(user_id, None))
+
+    # Shielded so a cancelled caller does not cancel the load for everyone else
+    return await asyncio.shield(load)
+
 def update_quest_progress(user: Dict[str, Any], completed_quests: Union[str, List[str]], progress: int = 1, *, query: Dict[str, Any] = None) -> Dict[str, Any]:
     global settings
 
@@ -364,7 +901,12 @@ def get_user_card_limit(user: Dict[str, Any]) -> int:
     extra_card_slots = user.get("extra_props", {}).get("extra_card_slots", 0)
     return settings.MAX_CARDS + extra_card_slots or settings.MAX_CARDS
 
-async def update_user(user_id: int, data: dict) -> None:
+async def update_user(user_id: int, data: dict, *, sync: bool = False) -> None:
+    """Apply the update to the cached user and write it to Mongo.
+
+    With write-behind enabled the write is buffered, pass `sync` for updates that must
+    be stored before returning, e.g. candy transfers between users.
+    """
     user = await get_user(user_id)
     data.setdefault('$set', {})['last_active_time'] = time.time()
 
@@ -403,9 +945,31 @@ async def update_user(user_id: int, data: dict) -> None:
             else:
                 raise ValueError(f"Invalid mode: {mode}")
 
+    if USER_WRITES.enabled and not sync:
+        return USER_WRITES.add(user_id, data)
+
+    # Earlier buffered updates, including the batch in flight, must not land after this one
+    if USER_WRITES.enabled or USER_WRITES.pending:
+        await USER_WRITES.flush()
+        if USER_WRITES.has_pending(user_id):
+            # Requeued by a transient error, one more try before refusing the update
+            await USER_WRITES.flush()
+            if USER_WRITES.has_pending(user_id):
+                raise ConnectionFailure(f"Buffered updates of user {user_id} could not be written.")
+
     await USERS_DB.update_one({"_id": user_id}, data)
 
 async def update_card(card_id: List[str] | str, data: dict, insert: bool = False) -> None:
+    card_ids = card_id if isinstance(card_id, list) else [card_id]
+    if not insert and data.keys() == {"$set"}:
+        # Goes out in the same bulk write as the fields already queued for these cards
+        for queued_id in card_ids:
+            CARD_WRITES.set(queued_id, data["$set"])
+        return await CARD_WRITES.flush()
+
+    # Queued fields for these cards, including the batch in flight, must not land after this update
+    await CARD_WRITES.flush()
+
     if insert:
         await CARDS_DB.insert_one({"_id": card_id})
 
@@ -427,4 +991,93 @@ async def check_wishlist(message: discord.Message, card_ids: List[str]) -> None:
                 if user:
                     await user.send(f"Your wish card has been rolled or traded by another player. {message.jump_url}")
             except Exception as _:
-                continue
\ No newline at end of file
+                continue
+
+def user_indexes() -> List[IndexKeys]:
+    """The indexes the leaderboards, reminders and inactivity sweeps rely on."""
+    indexes: List[IndexKeys] = [
+        [("exp", -1)],
+        [("candies", -1)],
+        [("game_state.music_game.points", -1)],
+        [("game_state.quiz_game.last_update", 1), ("game_state.quiz_game.points", -1)],
+        [("wishlist", 1)],
+        [("last_active_time", 1)]
+    ]
+    indexes.extend(
+        [("reminder", 1), (f"cooldown.{name}", 1)]
+        for name in settings.COOLDOWN_BASE.keys() if name != "claim"
+    )
+    indexes.extend(
+        [(f"game_state.match_game.{level}.matched", -1), (f"game_state.match_game.{level}.click_left", -1), (f"game_state.match_game.{level}.finished_time", 1)]
+        for level in settings.MATCH_GAME_SETTINGS.keys()
+    )
+    return indexes
+
+def hot_user_queries() -> Dict[str, Tuple[Dict[str, Any], IndexKeys | None]]:
+    """Representative (filter, sort) pairs of the frequent user queries."""
+    current_time = time.time()
+    start_time, end_time = get_month_unix_timestamps()
+    queries: Dict[str, Tuple[Dict[str, Any], IndexKeys | None]] = {
+        "exp leaderboard": ({}, [("exp", -1)]),
+        "candies leaderboard": ({}, [("candies", -1)]),
+        "music leaderboard": ({}, [("game_state.music_game.points", -1)]),
+        "quiz leaderboard": ({"game_state.quiz_game.last_update": {"$gt": start_time, "$lte": end_time}}, [("game_state.quiz_game.points", -1)]),
+        "wishlist": ({"wishlist": {"$in": ["1"]}}, None),
+        "inactive users": ({"last_active_time": {"$lt": current_time}}, None),
+        "reminder": ({"$and": [
+            {"reminder": True},
+            {"$or": [
+                {f"cooldown.{name}": {"$gt": current_time, "$lt": current_time + 600}}
+                for name in settings.COOLDOWN_BASE.keys() if name != "claim"
+            ]}
+        ]}, None)
+    }
+    for level in settings.MATCH_GAME_SETTINGS.keys():
+        queries[f"match game {level} leaderboard"] = ({}, [
+            (f"game_state.match_game.{level}.matched", -1),
+            (f"game_state.match_game.{level}.click_left", -1),
+            (f"game_state.match_game.{level}.finished_time", 1)
+        ])
+
+    return queries
+
+async def ensure_indexes() -> int:
+    """Create the user indexes that are missing and return how many were created."""
+    existing = [
+        [(field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in info["key"]]
+        for info in (await USERS_DB.index_information()).values()
+    ]
+    missing = [IndexModel(keys) for keys in user_indexes() if keys not in existing]
+    if missing:
+        await USERS_DB.create_indexes(missing)
+
+    return len(missing)
+
+def _plan_stages(plan: Dict[str, Any]) -> Iterator[str]:
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+async def verify_query_plans() -> List[str]:
+    """Explain every hot query and warn about the ones that scan the whole collection."""
+    collscans = []
+    for name, (query, sort) in hot_user_queries().items():
+        cursor = USERS_DB.find(query).limit(10)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        try:
+            explain = await cursor.explain()
+        except Exception as e:
+            logger.warning(f"Unable to explain the {name} query. Reason: {e}")
+            continue
+
+        if "COLLSCAN" in _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {})):
+            collscans.append(name)
+            logger.warning(f"The {name} query scans the whole users collection (COLLSCAN): filter={query}, sort={sort}")
+
+    return collscans
@@ -1,4 +1,6 @@
 from .pool import CardPool, QuestionPool, MusicPool
 from .objects import *
 from .utils import *
+from .cache import RenderCache, RENDER_CACHES
+from .render import GridCanvas, RenderExecutor, RENDER_EXECUTOR, TileSpec, FRAME_OVERLAYS, frame_paths, frame_size_rates, preload_frames
 from .music import Player
\ No newline at end of file
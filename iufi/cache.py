@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import functions as func
+
+from collections import OrderedDict
+from PIL import Image
+
+from typing import (
+    Any,
+    Dict,
+    List,
+    Set,
+    Tuple,
+    Union
+)
+
+CacheKey = Tuple[Any, ...]  # (card id, frame, size rate, hidden[, encode profile])
+
+def image_nbytes(image: Union[List[Image.Image], Image.Image]) -> int:
+    """Estimate the memory used by a decoded image or a list of GIF frames."""
+    images = image if isinstance(image, list) else [image]
+    return sum(img.width * img.height * len(img.getbands()) for img in images)
+
+class RenderCache:
+    """A byte-budgeted LRU cache for rendered card output.
+
+    The first element of every key is the card id, so all entries of a card can be
+    dropped at once when its state changes.
+    """
+
+    def __init__(self, name: str, setting_key: str, default_mb: int) -> None:
+        self.name: str = name
+        self._setting_key: str = setting_key
+        self._default_mb: int = default_mb
+
+        self._entries: OrderedDict[CacheKey, Tuple[Any, int]] = OrderedDict()
+        self._card_keys: Dict[str, Set[CacheKey]] = {}
+
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return int(func.settings.RENDER_SETTINGS.get(self._setting_key, self._default_mb) * 1024 * 1024)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return round(self.hits / total * 100, 1) if total else 0.0
+
+    def get(self, key: CacheKey) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: CacheKey, value: Any, nbytes: int) -> None:
+        if nbytes > self.max_bytes:
+            return
+
+        self._pop(key)
+        self._entries[key] = (value, nbytes)
+        self._card_keys.setdefault(key[0], set()).add(key)
+        self.size += nbytes
+
+        while self.size > self.max_bytes and self._entries:
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, card_id: str) -> None:
+        for key in self._card_keys.pop(card_id, set()).copy():
+            self._pop(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._card_keys.clear()
+        self.size = 0
+
+    def _pop(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        self.size -= entry[1]
+        keys = self._card_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._card_keys[key[0]]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+IMAGE_CACHE: RenderCache = RenderCache("Image", "image_cache_mb", 256)
+BYTES_CACHE: RenderCache = RenderCache("Bytes", "bytes_cache_mb", 64)
+RENDER_CACHES: List[RenderCache] = [IMAGE_CACHE, BYTES_CACHE]
+
+def invalidate_card(card_id: str) -> None:
+    for cache in RENDER_CACHES:
+        cache.invalidate(card_id)
+
+def clear_caches() -> None:
+    for cache in RENDER_CACHES:
+        cache.clear()
@@ -8,4 +8,10 @@ class DuplicatedCardError(IUFIException):
     """There was a duplicated id in the pool."""
 
 class DuplicatedTagError(IUFIException):
-    """There was a duplicated tag in the pool."""
\ No newline at end of file
+    """There was a duplicated tag in the pool."""
+
+class RenderQueueFullError(IUFIException):
+    """The render queue is full and the request could not be scheduled in time."""
+
+class NotEnoughCardsError(IUFIException):
+    """There are not enough available cards in the pool to fill the roll."""
\ No newline at end of file
@@ -3,7 +3,8 @@ from __future__ import annotations
 import random, os, asyncio, Levenshtein, re, yt_dlp
 import functions as func
 
-from PIL import Image, ImageDraw, ImageSequence
+from PIL import Image
+from abc import ABC, abstractmethod
 from io import BytesIO
 from difflib import SequenceMatcher
 
@@ -22,15 +23,24 @@ from typing import (
 )
 
 from .exceptions import ImageLoadError, IUFIException
+from .cache import IMAGE_CACHE, BYTES_CACHE, image_nbytes, invalidate_card
+from .render import (
+    CARD_SIZE,
+    SIZE_RATE,
+    FRAME_SIZE_INCREMENT,
+    RENDER_EXECUTOR,
+    TileSpec,
+    apply_frame,
+    encode_image,
+    load_tile,
+    render_grid,
+    round_corners
+)
 
 if TYPE_CHECKING:
     from .pool import CardPool
 
 YOUTUBE_REGEX = re.compile(r'(https?://)?(www\.)?youtube\.(com|nl)/watch\?v=([-\w]+)')
-CARD_SIZE = (1080, 1920)
-SIZE_RATE = 0.2
-FRAME_SIZE_INCREMENT = (0.005, 0.003)
-
 QUIZ_LEVEL_BASE: dict[str, tuple[int, tuple[int, int, hex]]] = {
     "easy": (10, (1, 1, 0x7CD74B)),
     "medium": (20, (3, 2, 0xF9E853)),
@@ -53,42 +63,15 @@ YTDL_FORMAT_OPTIONS: Dict[str, str] = {
 
 YTDL = yt_dlp.YoutubeDL(YTDL_FORMAT_OPTIONS)
 
-class CardObject:
+class CardObject(ABC):
     __slots__ = ("is_gif")
 
     def __init__(self) -> None:
         self.is_gif: bool = False;
     
-    def _round_corners(self, image: Image.Image, radius: int = 8) -> Image.Image:
-        """Creates a rounded corner image"""
-        radius = min(image.size) * radius // 100
-        mask = Image.new('L', image.size, 0)
-        draw = ImageDraw.Draw(mask)
-        draw.pieslice([(0, 0), (radius * 2, radius * 2)], 180, 270, fill=255)
-        draw.rectangle([(radius, 0), (image.size[0] - radius, image.size[1])], fill=255)
-        draw.rectangle([(0, radius), (image.size[0], image.size[1] - radius)], fill=255)
-        draw.pieslice([(image.size[0] - radius * 2, 0), (image.size[0], radius * 2)], 270, 360, fill=255)
-        draw.pieslice([(0, image.size[1] - radius * 2), (radius * 2, image.size[1])], 90, 180, fill=255)
-        draw.pieslice([(image.size[0] - radius * 2, image.size[1] - radius * 2), (image.size[0], image.size[1])], 0, 90, fill=255)
-
-        # Apply the mask to the image
-        output = Image.new('RGBA', image.size)
-        output.putalpha(mask)
-        output.paste(image, (0, 0), mask)
-
-        return output
-    
-    def _load_image(self, path: str, *, size_rate: float = SIZE_RATE) -> Union[List[Image.Image], Image.Image]:
-        """Load and process the image"""
-        try:
-            with Image.open(path) as img:
-                img_size = (int(CARD_SIZE[0] * size_rate), int(CARD_SIZE[1] * size_rate))
-                images = [self._round_corners(frame.resize(img_size)) for frame in ImageSequence.Iterator(img)]
-                self.is_gif = len(images) > 1
-                return images if len(images) > 1 else images[0]
-            
-        except Exception as e:
-            raise ImageLoadError(f"Unable to load the image. Reason: {e}")
+    @abstractmethod
+    def render_spec(self, hide_image_if_no_owner: bool = False) -> TileSpec:
+        """Describe how a render worker should draw this object."""
 
 class Card(CardObject):
     __slots__ = (
@@ -105,8 +88,6 @@ class Card(CardObject):
         "_lock"
     )
 
-    _frame_cache: Dict[str, Dict[str, Union[List[Image.Image], Image.Image]]] = {}  # Path to Frame
-
     def __init__(
         self,
         pool: CardPool,
@@ -132,69 +113,39 @@ class Card(CardObject):
         self._emoji: str = func.settings.TIERS_BASE.get(self._tier)[0]
         self._lock: asyncio.Lock = asyncio.Lock()
 
-    def _load_frame(self, image: Image.Image, frame: str = None, *, size_rate: float = SIZE_RATE) -> Image.Image:
-        try:
-            frame = frame or self._frame or self._tier
-            new_size_rate = size_rate - (FRAME_SIZE_INCREMENT[0] if frame else FRAME_SIZE_INCREMENT[1])
-            img_size = (int(CARD_SIZE[0] * new_size_rate), int(CARD_SIZE[1] * new_size_rate))
-            frame_size = (int(CARD_SIZE[0] * size_rate), int(CARD_SIZE[1] * size_rate))
-
-            # Check if the frame is in cache
-            frame_cache = Card._frame_cache.setdefault(str(size_rate), {})
+    def _image_path(self) -> str:
+        return os.path.join(func.ROOT_DIR, "images", self._tier, f"{self.id}.webp")
 
-            if frame not in frame_cache:
-                with Image.open(os.path.join(func.ROOT_DIR, "frames", f"{frame}.webp")) as frame_img:
+    def _frame_path(self, frame: str = None) -> str:
+        return os.path.join(func.ROOT_DIR, "frames", f"{frame or self._frame or self._tier}.webp")
 
-                    # Resize and cache the frame image
-                    frame_cache[frame] = frame_img.resize(frame_size, Image.LANCZOS)
+    def _load_frame(self, image: Image.Image, frame: str = None, *, size_rate: float = SIZE_RATE) -> Image.Image:
+        return apply_frame(image, self._frame_path(frame), size_rate=size_rate)
 
-            # Get the cached frame image
-            frame_img = frame_cache[frame]
+    def render_spec(self, hide_image_if_no_owner: bool = False) -> TileSpec:
+        if hide_image_if_no_owner and not self.owner_id:
+            return TempCard.cover(random.randint(1, 3)).render_spec()
 
-            # Create the final image with rounded corners and frame
-            result = Image.new('RGBA', frame_size)
-            image = self._round_corners(image.resize(img_size, Image.LANCZOS))
-            result.paste(image, ((frame_size[0] - img_size[0]) // 2, (frame_size[1] - img_size[1]) // 2))
-            result.paste(frame_img, (0, 0), frame_img)
-            return result
-        
-        except FileNotFoundError:
-            return self._round_corners(image.resize(img_size, Image.LANCZOS))
+        return TileSpec(self._image_path(), self._frame_path())
 
-    def _load_image(self, *, size_rate: float = SIZE_RATE) -> Union[list[Image.Image], Image.Image]:
-        """Load and process the image"""
+    def preview_frame(self, frame: str = None, profile: str = "interactive") -> BytesIO:
         try:
-            image_path = os.path.join(func.ROOT_DIR, "images", self._tier)
-
-            with Image.open(os.path.join(image_path, f"{self.id}.webp")) as img:
-                images = [self._load_frame(frame.convert('RGBA'), size_rate=size_rate) for frame in ImageSequence.Iterator(img)]
-                self.is_gif = len(images) > 1
-                return images if len(images) > 1 else images[0]
-                    
-        except Exception as e:
-            raise ImageLoadError(f"Unable to load the image. Reason: {e}")
-
-    def preview_frame(self, frame: str = None) -> BytesIO:
-        try:
-            image_path = os.path.join(func.ROOT_DIR, "images", self._tier)
-
-            image_bytes = BytesIO()
-            with Image.open(os.path.join(image_path, f"{self.id}.webp")) as img:
+            with Image.open(self._image_path()) as img:
                 if frame:
                     image = self._load_frame(img.resize(CARD_SIZE, Image.LANCZOS), frame)
                 else:
-                    image = self._round_corners(img.resize(CARD_SIZE, Image.LANCZOS))
+                    image = round_corners(img.resize(CARD_SIZE, Image.LANCZOS))
                     
-                image.save(image_bytes, format='WEBP')
-                image_bytes.seek(0)
-                return image_bytes
+                return BytesIO(encode_image(image, profile=profile))
         
         except Exception as e:
             raise ImageLoadError(f"Unable to load the image. Reason: {e}")
         
     def change_owner(self, owner_id: int | None = None) -> None:
         if self.owner_id != owner_id:
-            self.owner_id = owner_id
+            old_owner_id, self.owner_id = self.owner_id, owner_id
+            self._pool.index_owner(self, old_owner_id)
+            invalidate_card(self.id)
 
             if owner_id is None:
                 if self.stars > 5:
@@ -210,40 +161,56 @@ class Card(CardObject):
             return
         
         self.tag = tag
-        asyncio.create_task(func.update_card(self.id, {"$set": {"tag": tag}}))
+        func.CARD_WRITES.set(self.id, {"tag": tag})
     
     def change_frame(self, frame: str | None = None) -> None:
         if self._frame == frame:
             raise IUFIException("This frame is already assigned to this card.")
         
         self._frame = frame.lower() if frame else None
+        invalidate_card(self.id)
 
     def change_stars(self, stars: int) -> None:
         if self.stars != stars:
             self.stars = stars
-
-            asyncio.create_task(func.update_card(self.id, {"$set": {"stars": stars}}))
-
-    async def image_bytes(self, hide_image_if_no_owner: bool = False) -> BytesIO:
-        image = await self.image(hide_image_if_no_owner=hide_image_if_no_owner)
-        image_bytes = BytesIO()
-
-        if self.is_gif:
-            image[0].save(image_bytes, format="WEBP", save_all=True, append_images=image[1:], loop=0, duration=100, optimize=False)
-        else:
-            image.save(image_bytes, format='WEBP')
-        
-        image_bytes.seek(0)
-        return image_bytes
+            func.CARD_WRITES.set(self.id, {"stars": stars})
+
+    async def image_bytes(self, hide_image_if_no_owner: bool = False, profile: str = "standard") -> BytesIO:
+        """Return the encoded image, reusing the cached bytes while the card state is unchanged."""
+        cache_key = (self.id, self._frame, SIZE_RATE, hide_image_if_no_owner and not self.owner_id, profile)
+
+        data = BYTES_CACHE.get(cache_key)
+        if data is None:
+            if RENDER_EXECUTOR.use_processes:
+                data, _ = await RENDER_EXECUTOR.render(render_grid, [self.render_spec(hide_image_if_no_owner)], 1, SIZE_RATE, profile)
+            else:
+                image = await self.image(hide_image_if_no_owner=hide_image_if_no_owner)
+                data = await RENDER_EXECUTOR.run(encode_image, image, profile=profile)
+            BYTES_CACHE.put(cache_key, data, len(data))
+
+        return BytesIO(data)
     
     async def image(self, *, size_rate: float = SIZE_RATE, hide_image_if_no_owner: bool = False) -> Image.Image | list[Image.Image]:
         """Return the image or a list of images based on ownership status."""
         async with self._lock:
-            # Check if the image should be hidden due to no owner
-            if hide_image_if_no_owner and not self.owner_id:
-                return await TempCard(f"cover/level{random.randint(1, 3)}.webp").image(size_rate=size_rate)
+            hidden = hide_image_if_no_owner and not self.owner_id
+            cache_key = (self.id, self._frame, size_rate, hidden)
+
+            image = IMAGE_CACHE.get(cache_key)
+            if image is None:
+                # Hidden cards keep the same random cover until their state changes
+                if hidden:
+                    image = await TempCard.cover(random.randint(1, 3)).image(size_rate=size_rate)
+                else:
+                    try:
+                        image = await RENDER_EXECUTOR.render(load_tile, self.render_spec(), size_rate=size_rate)
+                    except (OSError, ValueError) as e:
+                        raise ImageLoadError(f"Unable to load the image. Reason: {e}")
+                    self.is_gif = isinstance(image, list)
+                
+                IMAGE_CACHE.put(cache_key, image, image_nbytes(image))
             
-            return await asyncio.to_thread(self._load_image, size_rate=size_rate)
+            return image
 
     @property
     def cost(self) -> int:
@@ -290,25 +257,44 @@ class Card(CardObject):
         return f"{self._emoji} {self.id.zfill(5)} " + (f"({self.tag})" if self.tag else "")
 
 class TempCard(CardObject):
+    _registry: Dict[str, TempCard] = {}  # Path to shared instance
     _image_cache: Dict[str, Dict[str, Union[List[Image.Image], Image.Image]]] = {}  # Path to Image
+    _bytes_cache: Dict[str, Dict[str, bytes]] = {}  # Path to encode profile to encoded image
 
     def __init__(self, path: str) -> None:
         super().__init__()
         self._path: str = path
         self._lock: asyncio.Lock = asyncio.Lock()
 
-    async def image_bytes(self) -> BytesIO:
-        """Return the image as bytes."""
-        images = await self.image()
-        image_bytes = BytesIO()
+    @classmethod
+    def get(cls, path: str) -> TempCard:
+        """Return the shared instance for a static asset, so its lock and caches are reused."""
+        if path not in cls._registry:
+            cls._registry[path] = cls(path)
 
-        if self.is_gif:
-            images[0].save(image_bytes, format="WEBP", save_all=True, append_images=images, loop=0, duration=100, optimize=False)
-        else:
-            images.save(image_bytes, format='WEBP')
+        return cls._registry[path]
+    
+    @classmethod
+    def cover(cls, level: int | str) -> TempCard:
+        return cls.get(f"cover/level{level}.webp")
+
+    @classmethod
+    async def preload(cls, levels: List[int | str]) -> None:
+        """Load and encode the covers up front, so drops and hidden cards never encode them."""
+        for level in levels:
+            await cls.cover(level).image_bytes()
 
-        image_bytes.seek(0)
-        return image_bytes
+    def render_spec(self, hide_image_if_no_owner: bool = False) -> TileSpec:
+        return TileSpec(self._path)
+
+    async def image_bytes(self, profile: str = "standard") -> BytesIO:
+        """Return the image as bytes."""
+        encoded = TempCard._bytes_cache.setdefault(self._path, {})
+        if profile not in encoded:
+            images = await self.image()
+            encoded[profile] = await RENDER_EXECUTOR.run(encode_image, images, profile=profile)
+
+        return BytesIO(encoded[profile])
     
     async def image(self, *, size_rate: float = SIZE_RATE, hide_image_if_no_owner: bool = False) -> Union[List[Image.Image], Image.Image]:
         """Load and return the image, caching it by size rate and path."""
@@ -317,7 +303,13 @@ class TempCard(CardObject):
                 TempCard._image_cache[self._path] = {}
 
             if size_rate not in TempCard._image_cache[self._path]:
-                TempCard._image_cache[self._path][size_rate] = await asyncio.to_thread(self._load_image, self._path, size_rate=size_rate)
+                try:
+                    image = await RENDER_EXECUTOR.render(load_tile, self.render_spec(), size_rate=size_rate)
+                except (OSError, ValueError) as e:
+                    raise ImageLoadError(f"Unable to load the image. Reason: {e}")
+
+                self.is_gif = isinstance(image, list)
+                TempCard._image_cache[self._path][size_rate] = image
                 
             return TempCard._image_cache[self._path][size_rate]
     
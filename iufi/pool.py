@@ -1,22 +1,26 @@
 from __future__ import annotations
 
-import os
+import os, time, asyncio
 import functions as func
 
 from collections import Counter
-from random import randint
+from pymongo import UpdateOne
+from io import BytesIO
+from random import randint, randrange, random
 
 from typing import (
     Optional,
     TYPE_CHECKING,
     Dict,
     Any,
-    List
+    FrozenSet,
+    List,
+    Set,
+    Tuple
 )
 
 from random import (
     choice,
-    choices,
     sample,
     shuffle
 )
@@ -28,7 +32,10 @@ from .objects import (
     Track
 )
 
-from .exceptions import IUFIException, DuplicatedCardError, DuplicatedTagError
+from .cache import clear_caches
+from .render import RENDER_EXECUTOR, SIZE_RATE, build_mips, prerender_cards
+from .utils import gen_cards_view
+from .exceptions import IUFIException, DuplicatedCardError, DuplicatedTagError, NotEnoughCardsError
 # from .deepsearch import (
 #     Load_Data,
 #     Search_Setup
@@ -37,6 +44,52 @@ from .exceptions import IUFIException, DuplicatedCardError, DuplicatedTagError
 if TYPE_CHECKING:
     from .music import Player
 
+class CardBag:
+    """Cards kept in a list plus an id to position index.
+
+    Adding, removing and uniform sampling are O(1) per card, removal swaps the last
+    card into the freed slot.
+    """
+    __slots__ = ("_cards", "_positions")
+
+    def __init__(self) -> None:
+        self._cards: List[Card] = []
+        self._positions: Dict[str, int] = {}
+
+    def add(self, card: Card) -> None:
+        if card.id not in self._positions:
+            self._positions[card.id] = len(self._cards)
+            self._cards.append(card)
+
+    def remove(self, card: Card) -> None:
+        if (position := self._positions.pop(card.id, None)) is None:
+            raise ValueError(f"Card {card.id} is not in the bag.")
+
+        last = self._cards.pop()
+        if position < len(self._cards):
+            self._cards[position] = last
+            self._positions[last.id] = position
+
+    def discard(self, card: Card) -> None:
+        if card in self:
+            self.remove(card)
+
+    def sample(self, k: int) -> List[Card]:
+        return sample(self._cards, k=k)
+
+    def clear(self) -> None:
+        self._cards.clear()
+        self._positions.clear()
+
+    def __contains__(self, card: Card) -> bool:
+        return card.id in self._positions
+
+    def __len__(self) -> int:
+        return len(self._cards)
+
+    def __iter__(self):
+        return iter(self._cards)
+
 DROP_RATES = {
     'common': .93,
     'rare': .05,
@@ -46,13 +99,61 @@ DROP_RATES = {
     "celestial": .00005
 }
 
+class AliasTable:
+    """Walker's alias method, weighted sampling in O(1) after an O(n) build."""
+    __slots__ = ("_keys", "_probabilities", "_aliases")
+
+    def __init__(self, weights: Dict[str, float]) -> None:
+        self._keys: List[str] = [key for key, weight in weights.items() if weight > 0]
+        self._probabilities: List[float] = [1.0] * len(self._keys)
+        self._aliases: List[int] = list(range(len(self._keys)))
+        if not self._keys:
+            return
+
+        total = sum(weights[key] for key in self._keys)
+        scaled = [weights[key] * len(self._keys) / total for key in self._keys]
+        small = [index for index, weight in enumerate(scaled) if weight < 1]
+        large = [index for index, weight in enumerate(scaled) if weight >= 1]
+
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self._probabilities[less], self._aliases[less] = scaled[less], more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+
+    def sample(self) -> Optional[str]:
+        if not self._keys:
+            return None
+
+        index = randrange(len(self._keys))
+        return self._keys[index] if random() < self._probabilities[index] else self._keys[self._aliases[index]]
+
+def luck_drop_rates(luck_rates: float = None) -> Dict[str, float]:
+    if not luck_rates:
+        return DROP_RATES.copy()
+
+    drop_rates = {k: v if k == 'common' else v * (1 + luck_rates) for k, v in DROP_RATES.items()}
+    total = sum(drop_rates.values())
+    drop_rates['common'] = 1 - (total - drop_rates['common'])
+    return drop_rates
+
 class CardPool:
     _cards: dict[str, Card] = {}
     _tag_cards: dict[str, Card] = {}
-    _available_cards: dict[str, List[Card]] = {
-        category: [] for category in DROP_RATES
+    _available_cards: dict[str, CardBag] = {
+        category: CardBag() for category in DROP_RATES
     }
     _match_game_cards: List[Card] = []
+    _tier_tables: Dict[Tuple[float, FrozenSet[str]], AliasTable] = {}  # (Luck, excluded tiers) to table
+
+    _owner_cards: Dict[int, Dict[str, Card]] = {}  # Owner id to their cards by id
+
+    # Rolls drawn and rendered ahead of time as (cards, encoded image, created time)
+    _prefetched_rolls: List[Tuple[List[Card], bytes, float]] = []
+    _prefetch_task: Optional[asyncio.Task] = None
+    _prefetch_wakeup: asyncio.Event = asyncio.Event()
+
+    _prerender_task: Optional[asyncio.Task] = None
 
     #DeepSearch
     # search_image: Search_Setup | None = None
@@ -63,28 +164,71 @@ class CardPool:
     #     cls.search_image = Search_Setup(image_list=image_list)
     #     cls.search_image.run_index()
 
-    @classmethod
-    async def fetch_data(cls) -> None:
-        # Fetch all card data from the database
-        all_card_data: Dict[str, Any] = {doc["_id"]: doc async for doc in func.CARDS_DB.find()}
+    @staticmethod
+    def _scan_cards_folder() -> Tuple[List[Tuple[str, str]], float]:
+        start_time = time.perf_counter()
+        images: List[Tuple[str, str]] = []  # (Category, card id)
+        with os.scandir(func.CARDS_FOLDER) as categories:
+            for category in categories:
+                if category.name.startswith(".") or not category.is_dir():
+                    continue
 
-        # Process existing cards in the cards folder
-        for category in os.listdir(func.CARDS_FOLDER):
-            if category.startswith("."):
-                continue
+                with os.scandir(category.path) as entries:
+                    images.extend(
+                        (category.name, os.path.splitext(entry.name)[0])
+                        for entry in entries if not entry.name.startswith(".")
+                    )
 
-            for image in os.listdir(os.path.join(func.CARDS_FOLDER, category)):
-                if image.startswith("."):
-                    continue
+        return images, time.perf_counter() - start_time
 
-                card_id = os.path.splitext(image)[0]
-                card_data = all_card_data.get(card_id, {"_id": card_id})
+    @staticmethod
+    async def _fetch_card_docs() -> Tuple[Dict[str, Any], float]:
+        start_time = time.perf_counter()
+        return {doc["_id"]: doc async for doc in func.CARDS_DB.find()}, time.perf_counter() - start_time
 
-                # Initialize stars if not present
-                if "stars" not in card_data:
-                    card_data["stars"] = (stars := randint(1, 5))
-                    await func.update_card(card_id, {"$set": {"stars": stars}})
-                cls.add_card(tier=category, **card_data)
+    @classmethod
+    async def fetch_data(cls) -> None:
+        # Scan the cards folder while all card data is fetched from the database
+        (images, scan_time), (all_card_data, fetch_time) = await asyncio.gather(
+            asyncio.to_thread(cls._scan_cards_folder), cls._fetch_card_docs()
+        )
+
+        start_time = time.perf_counter()
+        fixes: List[UpdateOne] = []
+        for category, card_id in images:
+            card_data = all_card_data.get(card_id, {"_id": card_id})
+
+            # Initialize stars if not present
+            if "stars" not in card_data:
+                card_data["stars"] = (stars := randint(1, 5))
+                fixes.append(UpdateOne({"_id": card_id}, {"$set": {"stars": stars}}, upsert=True))
+            cls.add_card(tier=category, **card_data)
+        build_time = time.perf_counter() - start_time
+
+        write_time = 0
+        if fixes:
+            start_time = time.perf_counter()
+            await func.CARDS_DB.bulk_write(fixes, ordered=False)
+            write_time = time.perf_counter() - start_time
+
+        func.logger.info(
+            f"Loaded {len(cls._cards)} cards (scan {scan_time:.2f}s, fetch {len(all_card_data)} docs {fetch_time:.2f}s, "
+            f"build {build_time:.2f}s, {len(fixes)} fixes written {write_time:.2f}s)"
+        )
+
+        if func.settings.RENDER_SETTINGS.get("prerender", False) and (not cls._prerender_task or cls._prerender_task.done()):
+            cls._prerender_task = asyncio.create_task(cls.prerender())
+
+        cls.schedule_roll_prefetch()
+
+    @classmethod
+    async def prerender(cls) -> None:
+        """Refresh the on-disk render cache with every card in its default tier frame."""
+        start_time = time.perf_counter()
+        sources = [(card._image_path(), card._frame_path(card.tier[1])) for card in cls._cards.values()]
+        built, reused, removed = await asyncio.to_thread(prerender_cards, sources, SIZE_RATE)
+
+        func.logger.info(f"Pre-rendered {built} cards ({reused} up to date, {removed} stale removed) in {time.perf_counter() - start_time:.1f}s")
 
     @classmethod
     async def process_new_cards(cls) -> None:
@@ -107,6 +251,12 @@ class CardPool:
                 target_image_path = os.path.join(func.CARDS_FOLDER, category, f"{card_id}.webp")
                 os.rename(new_image_path, target_image_path)
 
+                # Store the downscaled copies that normal renders decode instead of the full image
+                try:
+                    await RENDER_EXECUTOR.run(build_mips, target_image_path)
+                except (OSError, ValueError) as e:
+                    func.logger.warning(f"Unable to build mips for {target_image_path}. Reason: {e}")
+
                 # Set initial stars for the new card
                 await func.update_card(card_id, {"$set": {"stars": (stars := randint(1, 5))}}, insert=True)
                 cls.add_card(_id=card_id, tier=category, stars=stars)
@@ -115,10 +265,19 @@ class CardPool:
 
     @classmethod
     async def refresh(cls, process_new_cards: bool = False) -> None:
+        if cls._prefetch_task:
+            cls._prefetch_task.cancel()
+            await asyncio.gather(cls._prefetch_task, return_exceptions=True)
+            cls._prefetch_task = None
+        cls._prefetched_rolls.clear()
+
         cls._cards.clear()
         cls._tag_cards.clear()
-        cls._available_cards.clear()
+        cls._owner_cards.clear()
+        for available in cls._available_cards.values():
+            available.clear()
         cls._match_game_cards.clear()
+        clear_caches()
         await cls.fetch_data()
 
         if process_new_cards:
@@ -127,11 +286,13 @@ class CardPool:
     @classmethod
     def add_available_card(cls, card: Card) -> None:
         card.change_owner()
-        cls._available_cards[card.tier[1]].append(card)
+        cls._available_cards[card.tier[1]].add(card)
 
     @classmethod
     def remove_available_card(cls, card: Card) -> None:
-        cls._available_cards[card.tier[1]].remove(card)
+        # A card on screen may already be reserved by a prefetched roll, that roll is dropped
+        cls._available_cards[card.tier[1]].discard(card)
+        cls._drop_prefetched_rolls(card)
 
     @classmethod
     def add_tag(cls, card: Card, tag: str) -> None:
@@ -168,6 +329,8 @@ class CardPool:
         cls._cards[card.id] = card
         if not card.owner_id:
             cls.add_available_card(card)
+        else:
+            cls.index_owner(card)
         
         if card.tag:
             cls.add_tag(card, card.tag)
@@ -177,6 +340,37 @@ class CardPool:
 
         return card
     
+    @classmethod
+    def index_owner(cls, card: Card, old_owner_id: int | None = None) -> None:
+        """Move the card from the old owner's index entry to its current owner's."""
+        owned = cls._owner_cards.get(old_owner_id)
+        if owned and owned.pop(card.id, None) and not owned:
+            del cls._owner_cards[old_owner_id]
+
+        if card.owner_id:
+            cls._owner_cards.setdefault(card.owner_id, {})[card.id] = card
+
+    @classmethod
+    def get_owned_cards(cls, owner_id: int, tiers: List[str] = None) -> Dict[str, Card]:
+        owned = cls._owner_cards.get(owner_id, {})
+        if tiers is None:
+            return owned.copy()
+
+        return {card_id: card for card_id, card in owned.items() if card.tier[1] in tiers}
+
+    @classmethod
+    def count_owned_cards(cls, owner_id: int) -> int:
+        return len(cls._owner_cards.get(owner_id, {}))
+
+    @classmethod
+    def check_owned_cards(cls, owner_id: int, card_ids: List[str]) -> Tuple[Set[str], Set[str]]:
+        """Compare a user's stored card list with the pool.
+
+        Returns the ids the user lists but does not own, and the ids they own but do not list.
+        """
+        owned, listed = cls._owner_cards.get(owner_id, {}).keys(), set(card_ids)
+        return listed - owned, owned - listed
+
     @classmethod
     def get_card(cls, card_id: str) -> Card | None:
         if not card_id:
@@ -197,28 +391,136 @@ class CardPool:
                 
         return cards
     
+    @classmethod
+    def build_tier_tables(cls) -> None:
+        """Precompute the tier tables for the base rates and every luck potion level."""
+        cls._tier_tables.clear()
+        for luck_rates in [0, *func.settings.POTIONS_BASE.get("luck", {}).get("levels", {}).values()]:
+            cls.tier_table(luck_rates)
+
+    @classmethod
+    def tier_table(cls, luck_rates: float = None, excluded: FrozenSet[str] = frozenset()) -> AliasTable:
+        key = (luck_rates or 0, excluded)
+        if key not in cls._tier_tables:
+            drop_rates = luck_drop_rates(luck_rates)
+            cls._tier_tables[key] = AliasTable({k: v for k, v in drop_rates.items() if k not in excluded})
+
+        return cls._tier_tables[key]
+
     @classmethod
     def roll(cls, amount: int = 3, *, included: List[str] = None, avoid: List[str] = None, luck_rates: float = None) -> List[Card]:
-        results = included if included else []
+        results = list(included) if included else []
 
-        drop_rates = DROP_RATES.copy()
-        if luck_rates:
-            drop_rates = {k: v if k == 'common' else v * (1 + luck_rates) for k, v in DROP_RATES.items()}
-            total = sum(drop_rates.values())
-            drop_rates['common'] = 1 - (total - drop_rates['common'])
-        
-        if avoid:
-            drop_rates = {k: v for k, v in drop_rates.items() if k not in avoid}
+        # Tiers that ran out of available cards are left out of the draw
+        remaining = Counter({tier: len(cards) for tier, cards in cls._available_cards.items()})
+        remaining.subtract(results)
+        if exhausted := [tier for tier in set(results) if remaining[tier] < 0]:
+            raise NotEnoughCardsError(f"There are no {', '.join(exhausted)} cards available right now. Please try again later.")
+
+        excluded = set(avoid or [])
+
+        while len(results) < amount:
+            excluded.update(tier for tier, left in remaining.items() if left <= 0)
+            if not (tier := cls.tier_table(luck_rates, frozenset(excluded)).sample()):
+                break
+
+            results.append(tier)
+            remaining[tier] -= 1
+
+        if len(results) < amount:
+            raise NotEnoughCardsError("There are not enough cards available right now. Please try again later.")
 
-        results.extend(choices(list(drop_rates.keys()), weights=drop_rates.values(), k=amount - len(results)))
         cards = [
             card
             for cat, amt in Counter(results).items()
-            for card in sample(cls._available_cards[cat], k=amt)
+            for card in cls._available_cards[cat].sample(amt)
         ]
         shuffle(cards)
         return cards
 
+    @classmethod
+    def schedule_roll_prefetch(cls) -> None:
+        if func.settings.RENDER_SETTINGS.get("roll_prefetch", 0) <= 0:
+            return
+        
+        if cls._prefetch_task and not cls._prefetch_task.done():
+            return cls._prefetch_wakeup.set()
+
+        cls._prefetch_task = asyncio.create_task(cls._run_roll_prefetch())
+
+    @classmethod
+    async def _run_roll_prefetch(cls) -> None:
+        while (size := func.settings.RENDER_SETTINGS.get("roll_prefetch", 0)) > 0:
+            ttl = func.settings.RENDER_SETTINGS.get("roll_prefetch_ttl", 600)
+
+            # Give unused reservations back to the pool once they are too old
+            while cls._prefetched_rolls and time.time() - cls._prefetched_rolls[0][2] >= ttl:
+                cls._release_cards(cls._prefetched_rolls.pop(0)[0])
+
+            if len(cls._prefetched_rolls) >= size:
+                cls._prefetch_wakeup.clear()
+                try:
+                    await asyncio.wait_for(cls._prefetch_wakeup.wait(), cls._prefetched_rolls[0][2] + ttl - time.time())
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                cards = cls.roll()
+            except NotEnoughCardsError:
+                return func.logger.warning("Not enough available cards to prefetch a roll.")
+            
+            # Reserved cards leave the available pool so no other roll or drop can hand them out
+            for card in cards:
+                cls._available_cards[card.tier[1]].remove(card)
+
+            try:
+                image_bytes, _ = await gen_cards_view(cards)
+            except BaseException as e:
+                cls._release_cards(cards)
+                if not isinstance(e, Exception):
+                    raise
+                return func.logger.warning("Unable to prefetch a roll.", exc_info=e)
+
+            cls._prefetched_rolls.append((cards, image_bytes.getvalue(), time.time()))
+
+    @classmethod
+    def _release_cards(cls, cards: List[Card]) -> None:
+        for card in cards:
+            # Skip cards left over from before a refresh
+            if cls._cards.get(card.id) is not card or card.owner_id:
+                continue
+
+            cls._available_cards[card.tier[1]].add(card)
+
+    @classmethod
+    def _drop_prefetched_rolls(cls, card: Card) -> None:
+        kept = []
+        for roll in cls._prefetched_rolls:
+            if card in roll[0]:
+                cls._release_cards([other for other in roll[0] if other is not card])
+            else:
+                kept.append(roll)
+
+        if len(kept) != len(cls._prefetched_rolls):
+            cls._prefetched_rolls[:] = kept
+            cls.schedule_roll_prefetch()
+
+    @classmethod
+    def take_prefetched_roll(cls) -> Optional[Tuple[List[Card], BytesIO]]:
+        """Hand out a ready rendered roll, or None if none is ready yet."""
+        result = None
+        if cls._prefetched_rolls:
+            cards, data, created_time = cls._prefetched_rolls.pop(0)
+
+            # The cards go back to the pool either way, claiming removes them as usual
+            cls._release_cards(cards)
+            if time.time() - created_time < func.settings.RENDER_SETTINGS.get("roll_prefetch_ttl", 600) and not any(card.owner_id for card in cards):
+                result = cards, BytesIO(data)
+
+        cls.schedule_roll_prefetch()
+        return result
+
     @classmethod
     def get_random_cards_for_match_game(cls, amount: int = 3) -> List[Card]:
         cards = sample(cls._match_game_cards,amount)
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import os, mmap, struct, hashlib, threading
+import functions as func
+
+from PIL import Image
+
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union
+)
+
+RENDER_FOLDER = os.path.join(func.ROOT_DIR, "renders")
+ENTRY_SUFFIX = ".rgba"
+ENTRY_VERSION = 1
+
+# Magic, width, height, frame count. Raw RGBA frames follow back to back
+HEADER = struct.Struct("<4sHHH")
+MAGIC = b"IUFI"
+
+_frame_hashes: Dict[str, Tuple[int, str]] = {}  # Frame path to (mtime, content hash)
+
+def _frame_hash(frame_path: Optional[str]) -> str:
+    if not frame_path:
+        return "none"
+
+    try:
+        mtime = os.stat(frame_path).st_mtime_ns
+    except FileNotFoundError:
+        return "missing"
+
+    cached = _frame_hashes.get(frame_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(frame_path, "rb") as file:
+        digest = hashlib.sha1(file.read()).hexdigest()
+
+    _frame_hashes[frame_path] = (mtime, digest)
+    return digest
+
+def _rate_tag(size_rate: float) -> str:
+    return f"@{size_rate:g}"
+
+def entry_path(path: str, frame_path: Optional[str], size_rate: float) -> Optional[str]:
+    """Return the cache file for this source, or None if the source does not exist.
+
+    The name is derived from the source mtime and the frame content, so editing
+    either one simply points at a new entry. It ends with the size rate so each
+    rate can be pruned on its own.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = f"{ENTRY_VERSION}|{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{_frame_hash(frame_path)}|{size_rate}"
+    return os.path.join(RENDER_FOLDER, f"{hashlib.sha1(key.encode()).hexdigest()}{_rate_tag(size_rate)}{ENTRY_SUFFIX}")
+
+def read_entry(path: str, frame_path: Optional[str], size_rate: float) -> Union[List[Image.Image], Image.Image, None]:
+    """Memory-map a pre-rendered tile. The returned images share the mapped pages."""
+    cache_path = entry_path(path, frame_path, size_rate)
+    if cache_path is None:
+        return None
+
+    try:
+        with open(cache_path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if len(buffer) < HEADER.size:
+        return None
+
+    magic, width, height, count = HEADER.unpack_from(buffer)
+    frame_bytes = width * height * 4
+    if magic != MAGIC or len(buffer) != HEADER.size + frame_bytes * count:
+        return None
+
+    view = memoryview(buffer)
+    images = [
+        Image.frombuffer("RGBA", (width, height), view[HEADER.size + frame_bytes * i:HEADER.size + frame_bytes * (i + 1)], "raw", "RGBA", 0, 1)
+        for i in range(count)
+    ]
+    return images if count > 1 else images[0]
+
+def write_entry(cache_path: str, tile: Union[List[Image.Image], Image.Image]) -> None:
+    images = tile if isinstance(tile, list) else [tile]
+    width, height = images[0].size
+
+    # Unique per thread, the render pool may write entries in parallel
+    temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, width, height, len(images)))
+        for image in images:
+            file.write(image.convert("RGBA").tobytes())
+
+    os.replace(temp_path, cache_path)
+
+def prune_entries(keep: Set[str], size_rate: float) -> int:
+    """Delete every cache file of this size rate that is not listed in `keep`.
+
+    Entries of other size rates are left alone, files named before the rate was part
+    of the name are removed as well.
+    """
+    tag = _rate_tag(size_rate)
+    removed = 0
+    for entry in os.scandir(RENDER_FOLDER):
+        # Temp files are named after their entry, so both start with the digest and rate
+        stem = entry.name.split(ENTRY_SUFFIX, 1)[0]
+        if entry.path not in keep and entry.name.endswith((ENTRY_SUFFIX, ".tmp")) and (stem.endswith(tag) or "@" not in stem):
+            os.remove(entry.path)
+            removed += 1
+
+    return removed
+
+def card_sources(cards_folder: str = func.CARDS_FOLDER) -> Iterable[Tuple[str, str]]:
+    """Yield (image path, default frame path) for every card in the cards folder."""
+    frames_folder = os.path.join(func.ROOT_DIR, "frames")
+    for category in os.scandir(cards_folder):
+        if category.name.startswith(".") or not category.is_dir():
+            continue
+
+        frame_path = os.path.join(frames_folder, f"{category.name}.webp")
+        for image in os.scandir(category.path):
+            if not image.name.startswith("."):
+                yield image.path, frame_path
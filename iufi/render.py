@@ -0,0 +1,478 @@
+from __future__ import annotations
+
+import asyncio, multiprocessing, os, threading, math
+import numpy as np
+import functions as func
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageSequence
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union
+)
+
+from .cache import RenderCache, image_nbytes
+from .exceptions import RenderQueueFullError
+from .prerender import RENDER_FOLDER, entry_path, prune_entries, read_entry, write_entry
+
+CARD_SIZE = (1080, 1920)
+SIZE_RATE = 0.2
+FRAME_SIZE_INCREMENT = (0.005, 0.003)
+PADDING = 10
+FRAME_DURATION = 100  # Milliseconds each source GIF frame is shown
+LCM_FRAME_FACTOR = 2  # How many times its longest tile a grid may grow to loop every tile cleanly
+
+# Card sources are also stored downscaled to these fractions of CARD_SIZE
+MIP_FOLDER = os.path.join(func.ROOT_DIR, "mips")
+MIP_SCALES = (0.5, 0.2)
+
+# WebP options per output use. `animated_method` replaces `method` for animations,
+# where the slower methods cost seconds per grid
+ENCODE_PROFILES: Dict[str, Dict[str, Any]] = {
+    "interactive": {"quality": 70, "method": 0, "lossless": False},
+    "standard": {"quality": 80, "method": 4, "animated_method": 0, "lossless": False},
+    "gallery": {"quality": 95, "method": 6, "animated_method": 4, "lossless": False}
+}
+
+class TileSpec(NamedTuple):
+    """Everything a render worker needs to draw one card slot."""
+    path: str
+    frame_path: Optional[str] = None  # Covers and other static assets have no frame
+
+_mask_cache: Dict[Tuple[Tuple[int, int], int], Image.Image] = {}  # (Size, radius) to alpha mask
+_tile_cache: RenderCache = RenderCache("Worker", "worker_cache_mb", 64)
+
+def rounded_mask(size: Tuple[int, int], radius: int = 8) -> Image.Image:
+    """Return the shared rounded corner alpha mask for this size"""
+    mask = _mask_cache.get((size, radius))
+    if mask is None:
+        width, height = size
+        pixels = min(size) * radius // 100
+        mask = Image.new('L', size, 0)
+        draw = ImageDraw.Draw(mask)
+        draw.pieslice([(0, 0), (pixels * 2, pixels * 2)], 180, 270, fill=255)
+        draw.rectangle([(pixels, 0), (width - pixels, height)], fill=255)
+        draw.rectangle([(0, pixels), (width, height - pixels)], fill=255)
+        draw.pieslice([(width - pixels * 2, 0), (width, pixels * 2)], 270, 360, fill=255)
+        draw.pieslice([(0, height - pixels * 2), (pixels * 2, height)], 90, 180, fill=255)
+        draw.pieslice([(width - pixels * 2, height - pixels * 2), (width, height)], 0, 90, fill=255)
+        mask = _mask_cache.setdefault((size, radius), mask)
+
+    return mask
+
+def round_corners(image: Image.Image, radius: int = 8) -> Image.Image:
+    """Creates a rounded corner image"""
+    mask = rounded_mask(image.size, radius)
+    if 'A' not in image.getbands():
+        output = image.convert('RGBA')
+        output.putalpha(mask)
+        return output
+
+    # Keep the image's own transparency inside the rounded area
+    output = Image.new('RGBA', image.size)
+    output.paste(image, (0, 0), mask)
+    return output
+
+class FrameOverlays:
+    """Frame overlays decoded and resized once per size rate.
+
+    Size rates are rounded so that 0.2 and 0.2000001 share the same entry.
+    """
+
+    def __init__(self) -> None:
+        self._overlays: Dict[float, Dict[str, Image.Image]] = {}  # Size rate to frame path to resized frame
+
+    @staticmethod
+    def normalize(size_rate: float) -> float:
+        return round(float(size_rate), 4)
+
+    def get(self, frame_path: str, size_rate: float) -> Optional[Image.Image]:
+        """Return the resized overlay, or None if the frame file does not exist."""
+        overlays = self._overlays.setdefault(self.normalize(size_rate), {})
+        overlay = overlays.get(frame_path)
+        if overlay is None:
+            try:
+                with Image.open(frame_path) as frame_img:
+                    frame_size = (int(CARD_SIZE[0] * size_rate), int(CARD_SIZE[1] * size_rate))
+                    overlay = overlays.setdefault(frame_path, frame_img.convert('RGBA').resize(frame_size, Image.LANCZOS))
+            except FileNotFoundError:
+                return None
+
+        return overlay
+
+    def preload(self, frame_paths: Iterable[str], size_rates: Iterable[float]) -> int:
+        frame_paths = list(frame_paths)
+        for size_rate in size_rates:
+            for frame_path in frame_paths:
+                self.get(frame_path, size_rate)
+
+        return len(self)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(image_nbytes(overlay) for overlays in self._overlays.values() for overlay in overlays.values())
+
+    def clear(self) -> None:
+        self._overlays.clear()
+
+    def __len__(self) -> int:
+        return sum(len(overlays) for overlays in self._overlays.values())
+
+FRAME_OVERLAYS: FrameOverlays = FrameOverlays()
+
+def frame_paths() -> List[str]:
+    """Every tier frame and every frame in FRAMES_BASE."""
+    names = list(func.settings.TIERS_BASE) + list(func.settings.FRAMES_BASE)
+    return [os.path.join(func.ROOT_DIR, "frames", f"{name}.webp") for name in names]
+
+def frame_size_rates() -> List[float]:
+    return func.settings.RENDER_SETTINGS.get("frame_size_rates", [SIZE_RATE])
+
+def preload_frames(paths: List[str], size_rates: List[float]) -> int:
+    return FRAME_OVERLAYS.preload(paths, size_rates)
+
+def init_worker(render_settings: Dict[str, Any], paths: List[str], size_rates: List[float]) -> None:
+    """Process worker initializer. Workers import `functions` fresh and never load settings.json."""
+    func.settings.RENDER_SETTINGS = render_settings
+    preload_frames(paths, size_rates)
+
+def apply_frame(image: Image.Image, frame_path: Optional[str], *, size_rate: float = SIZE_RATE) -> Image.Image:
+    """Round the image corners and place it inside the frame overlay"""
+    new_size_rate = size_rate - (FRAME_SIZE_INCREMENT[0] if frame_path else FRAME_SIZE_INCREMENT[1])
+    img_size = (int(CARD_SIZE[0] * new_size_rate), int(CARD_SIZE[1] * new_size_rate))
+    frame_size = (int(CARD_SIZE[0] * size_rate), int(CARD_SIZE[1] * size_rate))
+    if not frame_path:
+        return round_corners(image.resize(img_size, Image.LANCZOS))
+
+    frame_img = FRAME_OVERLAYS.get(frame_path, size_rate)
+    if frame_img is None:
+        return round_corners(image.resize(img_size, Image.LANCZOS))
+
+    # Create the final image with rounded corners and frame
+    result = Image.new('RGBA', frame_size)
+    result.paste(image.resize(img_size, Image.LANCZOS), ((frame_size[0] - img_size[0]) // 2, (frame_size[1] - img_size[1]) // 2), rounded_mask(img_size))
+    result.paste(frame_img, (0, 0), frame_img)
+    return result
+
+def load_tile(spec: TileSpec, *, size_rate: float = SIZE_RATE) -> Union[List[Image.Image], Image.Image]:
+    """Return the processed frame(s) of a slot, from the pre-render cache when it is up to date"""
+    tile = read_entry(spec.path, spec.frame_path, size_rate)
+    if tile is not None:
+        return tile
+
+    return decode_tile(spec, size_rate=size_rate)
+
+def mip_path(path: str, scale: float) -> Optional[str]:
+    """Return where the mip of a card image lives, or None for images outside the cards folder"""
+    relative = os.path.relpath(os.path.abspath(path), func.CARDS_FOLDER)
+    if relative.startswith(os.pardir):
+        return None
+
+    name, ext = os.path.splitext(relative)
+    return os.path.join(MIP_FOLDER, f"{name}@{round(scale * 100)}{ext}")
+
+def _fresh_mip(path: str, scale: float, source_mtime: int) -> Optional[str]:
+    mip = mip_path(path, scale)
+    try:
+        if mip and os.stat(mip).st_mtime_ns >= source_mtime:
+            return mip
+    except FileNotFoundError:
+        pass
+
+    return None
+
+def source_path(path: str, size_rate: float) -> str:
+    """Return the smallest up to date mip that still covers the size rate, else the source"""
+    try:
+        source_mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return path
+
+    for scale in sorted(MIP_SCALES):
+        if scale >= size_rate and (mip := _fresh_mip(path, scale, source_mtime)):
+            return mip
+
+    return path
+
+def build_mips(path: str) -> int:
+    """Write the missing or outdated mips of a card image. Returns how many were written."""
+    source_mtime = os.stat(path).st_mtime_ns
+    scales = [scale for scale in MIP_SCALES if mip_path(path, scale) and not _fresh_mip(path, scale, source_mtime)]
+    if not scales:
+        return 0
+
+    with Image.open(path) as img:
+        duration = img.info.get("duration", FRAME_DURATION)
+        frames = [frame.convert('RGBA') for frame in ImageSequence.Iterator(img)]
+
+    for scale in scales:
+        mip = mip_path(path, scale)
+        os.makedirs(os.path.dirname(mip), exist_ok=True)
+
+        size = (int(CARD_SIZE[0] * scale), int(CARD_SIZE[1] * scale))
+        resized = [frame.resize(size, Image.LANCZOS) for frame in frames]
+
+        # Lossless, so a tile drawn from a mip matches one drawn from the source
+        temp_path = f"{mip}.{os.getpid()}.{threading.get_ident()}.tmp"
+        resized[0].save(temp_path, format="WEBP", lossless=True, save_all=len(resized) > 1, append_images=resized[1:], duration=duration, loop=0)
+        os.replace(temp_path, mip)
+
+    return len(scales)
+
+def decode_tile(spec: TileSpec, *, size_rate: float = SIZE_RATE) -> Union[List[Image.Image], Image.Image]:
+    """Decode the source image of a slot and return its processed frame(s)"""
+    with Image.open(source_path(spec.path, size_rate)) as img:
+        if spec.frame_path:
+            images = [apply_frame(frame.convert('RGBA'), spec.frame_path, size_rate=size_rate) for frame in ImageSequence.Iterator(img)]
+        else:
+            img_size = (int(CARD_SIZE[0] * size_rate), int(CARD_SIZE[1] * size_rate))
+            images = [round_corners(frame.resize(img_size)) for frame in ImageSequence.Iterator(img)]
+
+    return images if len(images) > 1 else images[0]
+
+def encode_options(profile: str) -> Dict[str, Any]:
+    """Return the WebP options of a profile, with overrides from RENDER_SETTINGS.encode_profiles"""
+    if profile not in ENCODE_PROFILES:
+        raise ValueError(f"Unknown encode profile: {profile}")
+
+    return {**ENCODE_PROFILES[profile], **func.settings.RENDER_SETTINGS.get("encode_profiles", {}).get(profile, {})}
+
+def encode_image(image: Union[List[Image.Image], Image.Image], duration: Union[List[int], int] = FRAME_DURATION, *, profile: str = "standard") -> bytes:
+    """Encode the image or GIF frames into WebP bytes"""
+    options = encode_options(profile)
+    animated_method = options.pop("animated_method", options["method"])
+
+    image_bytes = BytesIO()
+    if isinstance(image, list):
+        # Without extra keyframes every frame after the first only stores the rectangle that changed
+        options["method"] = animated_method
+        image[0].save(image_bytes, format="WEBP", save_all=True, append_images=image[1:], loop=0, duration=duration, kmin=0, kmax=0, **options)
+    else:
+        image.save(image_bytes, format="WEBP", **options)
+
+    return image_bytes.getvalue()
+
+def plan_frames(lengths: List[int], cap: int) -> int:
+    """Return how many frames a grid needs.
+
+    The longest tile sets the timeline and shorter tiles restart early. The least common
+    multiple, where every tile loops cleanly, is only used when it is at most
+    LCM_FRAME_FACTOR times that length. `cap` is a hard limit either way.
+    """
+    if not lengths:
+        return 1
+
+    frame_count = max(lengths)
+    if (lcm := math.lcm(*lengths)) <= frame_count * LCM_FRAME_FACTOR:
+        frame_count = lcm
+
+    return max(1, min(frame_count, cap))
+
+class GridCanvas:
+    """A card grid kept in memory, so that a change only re-pastes the slots it touches.
+
+    Static tiles are written into a single (height, width, RGBA) array with slice
+    assignment. Animated tiles are only kept as tiles, their frames are pasted over a
+    copy of that array one grid frame at a time while encoding, so a long lived canvas
+    costs one frame of memory.
+    """
+
+    def __init__(self, slots: int, cards_per_row: int, *, size_rate: float = SIZE_RATE) -> None:
+        self.cards_per_row: int = cards_per_row
+        self.card_size: Tuple[int, int] = (int(CARD_SIZE[0] * size_rate), int(CARD_SIZE[1] * size_rate))
+        num_rows = (slots + cards_per_row - 1) // cards_per_row
+        self.size: Tuple[int, int] = (
+            (self.card_size[0] * cards_per_row) + (PADDING * (cards_per_row - 1)),
+            (self.card_size[1] * num_rows) + (PADDING * (num_rows - 1))
+        )
+
+        self._tiles: List[Union[List[Image.Image], Image.Image, None]] = [None] * slots
+        self._canvas: np.ndarray = np.zeros((self.size[1], self.size[0], 4), dtype=np.uint8)
+        self._lock: threading.Lock = threading.Lock()
+
+    def _slot(self, canvas: np.ndarray, index: int) -> np.ndarray:
+        x = (self.card_size[0] + PADDING) * (index % self.cards_per_row)
+        y = (self.card_size[1] + PADDING) * (index // self.cards_per_row)
+        return canvas[y:y + self.card_size[1], x:x + self.card_size[0]]
+
+    def _paste(self, canvas: np.ndarray, index: int, image: Optional[Image.Image]) -> None:
+        slot = self._slot(canvas, index)
+        if image is None:
+            slot[...] = 0
+            return
+
+        pixels = np.asarray(image.convert('RGBA') if image.mode != 'RGBA' else image)
+        height, width = pixels.shape[:2]
+        if (width, height) != self.card_size:
+            slot[...] = 0
+
+        slot[:height, :width] = pixels
+
+    def update(self, tiles: Dict[int, Union[List[Image.Image], Image.Image, None]], profile: str = "standard") -> bytes:
+        """Replace the given slots and return the encoded grid"""
+        with self._lock:
+            for index, tile in tiles.items():
+                self._tiles[index] = tile
+                # Animated slots stay empty here and are filled per frame below
+                self._paste(self._canvas, index, None if isinstance(tile, list) else tile)
+
+            animated = {index: tile for index, tile in enumerate(self._tiles) if isinstance(tile, list)}
+            if not animated:
+                return encode_image(Image.fromarray(self._canvas, 'RGBA'), profile=profile)
+
+            frame_count = plan_frames([len(tile) for tile in animated.values()], func.settings.RENDER_SETTINGS.get("gif_frame_cap", 120))
+
+            # Identical consecutive frames are sent once and shown for longer
+            frames, durations, previous = [], [], None
+            for frame_index in range(frame_count):
+                frame = self._canvas.copy()
+                for index, tile in animated.items():
+                    self._paste(frame, index, tile[frame_index % len(tile)])
+
+                if previous is not None and np.array_equal(frame, previous):
+                    durations[-1] += FRAME_DURATION
+                else:
+                    frames.append(Image.fromarray(frame, 'RGBA'))
+                    durations.append(FRAME_DURATION)
+                previous = frame
+
+            return encode_image(frames if len(frames) > 1 else frames[0], durations, profile=profile)
+
+def compose_grid(tiles: List[Union[List[Image.Image], Image.Image, None]], cards_per_row: int, *, size_rate: float = SIZE_RATE, profile: str = "standard") -> bytes:
+    """Paste every tile into one grid image and encode it"""
+    return GridCanvas(len(tiles), cards_per_row, size_rate=size_rate).update(dict(enumerate(tiles)), profile)
+
+def _cached_tile(spec: TileSpec, size_rate: float) -> Union[List[Image.Image], Image.Image]:
+    cache_key = (spec.path, spec.frame_path, size_rate, False)
+    tile = _tile_cache.get(cache_key)
+    if tile is None:
+        tile = load_tile(spec, size_rate=size_rate)
+        _tile_cache.put(cache_key, tile, image_nbytes(tile))
+
+    return tile
+
+def render_grid(specs: List[Optional[TileSpec]], cards_per_row: int, size_rate: float = SIZE_RATE, profile: str = "standard") -> Tuple[bytes, List[bool]]:
+    """Render a whole grid from its spec. This is the entry point of the process backend.
+    
+    Returns the encoded image and whether each slot turned out to be animated.
+    """
+    tiles = [_cached_tile(spec, size_rate) if spec else None for spec in specs]
+    return compose_grid(tiles, cards_per_row, size_rate=size_rate, profile=profile), [isinstance(tile, list) for tile in tiles]
+
+def prerender_cards(sources: Iterable[Tuple[str, Optional[str]]], size_rate: float = SIZE_RATE) -> Tuple[int, int, int]:
+    """Write every (image path, frame path) source into the on-disk render cache.
+
+    Returns how many entries were built, reused and removed as stale.
+    """
+    os.makedirs(RENDER_FOLDER, exist_ok=True)
+
+    keep, built, reused = set(), 0, 0
+    for path, frame_path in sources:
+        cache_path = entry_path(path, frame_path, size_rate)
+        if cache_path is None:
+            continue
+
+        keep.add(cache_path)
+        if os.path.exists(cache_path):
+            reused += 1
+            continue
+
+        try:
+            build_mips(path)
+            write_entry(cache_path, decode_tile(TileSpec(path, frame_path), size_rate=size_rate))
+            built += 1
+        except (OSError, ValueError) as e:
+            func.logger.warning(f"Unable to pre-render {path}. Reason: {e}")
+
+    return built, reused, prune_entries(keep, size_rate)
+
+class RenderExecutor:
+    """Runs image work on a fixed number of workers behind a bounded queue.
+
+    Callers wait for a free slot before their job is submitted. When the queue stays
+    full for longer than `queue_timeout`, the job is rejected instead of piling up.
+    """
+
+    def __init__(self) -> None:
+        self._executor: Optional[Executor] = None
+        self._process_executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        self.workers: int = 0
+        self.queue_size: int = 0
+        self.pending: int = 0
+        self.completed: int = 0
+        self.rejected: int = 0
+
+    @property
+    def use_processes(self) -> bool:
+        return func.settings.RENDER_SETTINGS.get("backend", "thread") == "process"
+
+    def _setup(self) -> None:
+        settings = func.settings.RENDER_SETTINGS
+        self.workers = max(1, settings.get("workers", 4))
+        self.queue_size = max(0, settings.get("queue_size", 32))
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="iufi-render")
+        if self.use_processes:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._process_executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(method),
+                initializer=init_worker,
+                initargs=(dict(settings), frame_paths(), frame_size_rates())
+            )
+
+        self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+
+    async def run(self, fn: Callable[..., Any], /, *args, **kwargs) -> Any:
+        """Run in-process work (anything returning live PIL objects) on the thread pool."""
+        return await self._submit(False, fn, *args, **kwargs)
+
+    async def render(self, fn: Callable[..., Any], /, *args, **kwargs) -> Any:
+        """Run a module-level render function on the configured backend.
+
+        With the process backend, `fn` and its arguments must be picklable.
+        """
+        return await self._submit(self.use_processes, fn, *args, **kwargs)
+
+    async def _submit(self, use_process: bool, fn: Callable[..., Any], /, *args, **kwargs) -> Any:
+        if self._executor is None:
+            self._setup()
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), func.settings.RENDER_SETTINGS.get("queue_timeout", 15))
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise RenderQueueFullError("Too many images are being drawn right now. Please try again in a moment!")
+
+        self.pending += 1
+        try:
+            executor = self._process_executor if use_process and self._process_executor else self._executor
+            return await asyncio.get_running_loop().run_in_executor(executor, partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        if self._executor is None:
+            return
+
+        for executor in (self._executor, self._process_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        self._executor, self._process_executor, self._slots = None, None, None
+
+RENDER_EXECUTOR: RenderExecutor = RenderExecutor()
@@ -1,4 +1,4 @@
-import discord, os, iufi, logging, ctypes, ctypes.util
+import discord, os, iufi, logging, ctypes, ctypes.util, asyncio
 import functions as func
 
 from discord.ext import commands
@@ -68,15 +68,34 @@ class IUFI(commands.Bot):
         func.QUESTIONS_DB = func.MONGO_DB[db_name]["questions"]
         func.MUSIC_DB = func.MONGO_DB[db_name]["musics"]
 
+        # Index the fields the hot queries filter and sort on
+        try:
+            if created := await func.ensure_indexes():
+                func.logger.info(f"Created {created} missing user indexes")
+
+            if func.settings.DATABASE_SETTINGS.get("verify_query_plans", True):
+                await func.verify_query_plans()
+        except Exception as e:
+            func.logger.error("Unable to verify the user indexes.", exc_info=e)
+
     async def setup_hook(self) -> None:
         # Connecting to MongoDB
         await self.connect_db()
 
+        # Apply the user updates that were still buffered when the bot last stopped
+        if replayed := await func.USER_WRITES.replay():
+            func.logger.warning(f"Replayed {replayed} journaled user updates")
+
         await iufi.CardPool.fetch_data()
         await iufi.CardPool.process_new_cards()
         await iufi.QuestionPool.fetch_data()
         await iufi.MusicPool.fetch_data()
 
+        # Decode every frame overlay before the first framed render needs it
+        frames = await asyncio.to_thread(iufi.preload_frames, iufi.frame_paths(), iufi.frame_size_rates())
+        func.logger.info(f"Preloaded {frames} frame overlays ({iufi.FRAME_OVERLAYS.nbytes / 1024 ** 2:.1f}MB)")
+        await iufi.TempCard.preload(sorted({"1", "2", "3", *func.settings.MATCH_GAME_SETTINGS}))
+
         try:
             if not discord.opus.is_loaded():
                 opus_library = ctypes.util.find_library('opus')
@@ -90,6 +109,20 @@ class IUFI(commands.Bot):
                 await self.load_extension(f"cogs.{module[:-3]}")
                 func.logger.info(f"Loaded {module[:-3]}")
 
+    async def close(self) -> None:
+        try:
+            await func.USER_WRITES.close()
+        except Exception as e:
+            func.logger.error("Unable to flush the buffered user updates, they stay in the journal.", exc_info=e)
+
+        try:
+            await func.CARD_WRITES.close()
+        except Exception as e:
+            func.logger.error(f"Unable to flush {len(func.CARD_WRITES)} queued card updates.", exc_info=e)
+
+        iufi.RENDER_EXECUTOR.shutdown()
+        await super().close()
+
     async def on_ready(self):
         func.logger.info("------------------")
         func.logger.info(f"Logging As {self.user}")
@@ -128,6 +161,7 @@ class IUFI(commands.Bot):
 
 # Load IUFI Settings
 func.settings.load()
+iufi.CardPool.build_tier_tables()
 
 # Initialize logging settings for the bot to ensure proper monitoring and debugging
 LOG_SETTINGS = func.settings.LOGGING
@@ -0,0 +1,16 @@
+import argparse, time
+
+from iufi.prerender import card_sources
+from iufi.render import SIZE_RATE, prerender_cards
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render every card into the on-disk render cache.")
+    parser.add_argument("--size-rate", type=float, default=SIZE_RATE, help="Size rate to render the cards at.")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    built, reused, removed = prerender_cards(card_sources(), args.size_rate)
+    print(f"Pre-rendered {built} cards ({reused} up to date, {removed} stale removed) in {time.perf_counter() - start_time:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,7 @@ class CaptionModal(discord.ui.Modal):
         await interaction.response.defer()
 
         caption = self.children[0].value or ""
-        image_bytes, image_format = await iufi.gen_cards_view(self.view.cards, size_rate=iufi.objects.SIZE_RATE if self.view.is_gif() else 1)
+        image_bytes, image_format = await iufi.gen_cards_view(self.view.cards, size_rate=iufi.objects.SIZE_RATE if self.view.is_gif() else 1, profile="gallery")
         if self.view.cards and (gallery_channel := interaction.guild.get_channel(func.settings.GALLERY_CHANNEL)):
             message = await gallery_channel.send(
                 content=f"{caption}\nSent by {interaction.user.mention}",
@@ -46,7 +46,7 @@ class HDBtn(discord.ui.Button):
             return await interaction.response.send_message("Some cards in your current collection do not support HD.", ephemeral=True)
         
         await interaction.response.defer()
-        await self.view.send_msg(1)
+        await self.view.send_msg(1, "gallery")
 
 class GalleryBtn(discord.ui.Button):
     def __init__(self) -> None:
@@ -163,7 +163,7 @@ class CollectionView(discord.ui.View):
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         return self.ctx.author == interaction.user
     
-    async def send_msg(self, size_rate: float = iufi.objects.SIZE_RATE) -> None:
+    async def send_msg(self, size_rate: float = iufi.objects.SIZE_RATE, profile: str = "interactive") -> None:
         self.cards.clear()
 
         embed = discord.Embed(title=f"❤️  {self.member.display_name}'s {self.sel_collection.title()} Collection", color=discord.Color.random())
@@ -180,7 +180,7 @@ class CollectionView(discord.ui.View):
             self.cards.append(None)
             
         embed.description += "```"
-        image_bytes, image_format = await iufi.gen_cards_view(self.cards, size_rate=size_rate)
+        image_bytes, image_format = await iufi.gen_cards_view(self.cards, size_rate=size_rate, profile=profile)
         embed.set_image(url=f"attachment://image.{image_format}")
         image_file = discord.File(image_bytes, filename=f'image.{image_format}')
 
@@ -1,7 +1,7 @@
-import discord, asyncio
+import discord
 import functions as func
 
-from iufi import Card
+from iufi import Card, RENDER_EXECUTOR
 
 class FrameDropDown(discord.ui.Select):
     def __init__(self):
@@ -52,7 +52,7 @@ class FrameView(discord.ui.View):
     async def build(self) -> tuple[discord.Embed, discord.File]:
         embed = discord.Embed(title="🖼️  Frame Preview", color=discord.Color.random())
         embed.description = f"```🆔 {self.card.tier[0]} {self.card.id}\n🖼️ {self._selected_frame.title()}\n🍬 {self._price}```"
-        bytes = await asyncio.to_thread(self.card.preview_frame, self._selected_frame)
+        bytes = await RENDER_EXECUTOR.run(self.card.preview_frame, self._selected_frame, "interactive")
         embed.set_image(url="attachment://image.webp")
 
         return embed, discord.File(bytes, filename="image.webp")
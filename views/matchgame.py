@@ -5,10 +5,12 @@ from iufi import (
     Card,
     TempCard,
     CardPool,
-    gen_cards_view
+    GridCanvas,
+    RENDER_EXECUTOR
 )
 
 from random import shuffle, choice
+from io import BytesIO
 from typing import Any
 from collections import Counter
 
@@ -98,7 +100,7 @@ class MatchGame(discord.ui.View):
         self._need_wait: bool = False
         self.clicked: int = 0
         self._last_clicked: discord.ui.Button = None
-        self.covered_card: TempCard = TempCard(f"cover/level{self._level}.webp")
+        self.covered_card: TempCard = TempCard.cover(self._level)
 
         cards: list[Card] = CardPool.get_random_cards_for_match_game(self._cards)
         cards.extend(cards)
@@ -106,6 +108,8 @@ class MatchGame(discord.ui.View):
         shuffle(self.cards)
 
         self.guessed: dict[str, Card] = {}
+        self._board: GridCanvas = GridCanvas(len(self.cards), self._data.get("elem_per_row"))
+        self._drawn: list[Card | TempCard | None] = [None] * len(self.cards)
         self.embed_color = discord.Color.random()
         self.response: discord.Message = None
 
@@ -208,10 +212,14 @@ class MatchGame(discord.ui.View):
             color=self.embed_color
         )   
 
-        bytes, image_format = await gen_cards_view([card for card in self.guessed.values()], cards_per_row=self._data.get("elem_per_row"))
-        embed.set_image(url=f"attachment://image.{image_format}")
+        # Only the slots that changed since the last build are drawn again
+        changed = {index: card for index, card in enumerate(self.guessed.values()) if self._drawn[index] is not card}
+        tiles = await asyncio.gather(*[card.image() for card in changed.values()])
+        data = await RENDER_EXECUTOR.run(self._board.update, dict(zip(changed, tiles)), "interactive")
+        self._drawn = list(self.guessed.values())
 
-        return embed, discord.File(bytes, filename=f"image.{image_format}")
+        embed.set_image(url="attachment://image.webp")
+        return embed, discord.File(BytesIO(data), filename="image.webp")
 
     def matched(self) -> int:
         counter = Counter([card for card in self.guessed.values() if card != self.covered_card])
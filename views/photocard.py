@@ -115,10 +115,10 @@ class PhotoCardView(discord.ui.View):
 
         self.author: discord.Member = author
         self.user: dict[str, Any] = user
-        self.cards: dict[str, Card | None] = {}
-        for card_id in user.get("cards", []):
-            if card := CardPool.get_card(card_id):
-                self.cards[card_id] = card
+        owned_cards = CardPool.get_owned_cards(user["_id"])
+        self.cards: dict[str, Card | None] = {
+            card_id: owned_cards[card_id] for card_id in user.get("cards", []) if card_id in owned_cards
+        }
 
         self.page: int = ceil(len(self.cards) / 8)
         self.current_page: int = 1
@@ -147,7 +147,7 @@ class PhotoCardView(discord.ui.View):
         embed.set_footer(text="Pages: {}/{}".format(self.current_page, self.page))
 
         if self.toggle_cards_view:
-            image_bytes, image_format = await gen_cards_view(cards, 4)
+            image_bytes, image_format = await gen_cards_view(cards, 4, profile="interactive")
             embed.set_image(url=f"attachment://image.{image_format}")
             return embed, discord.File(image_bytes, filename=f"image.{image_format}")
         else:
@@ -86,11 +86,11 @@ class TradeView(discord.ui.View):
             # Seller
             _seller = await func.get_user(self.seller.id)
             seller_query = func.update_quest_progress(_seller, "TRADE_ANY_CARD", progress=len(self.cards), query={"$pull": {"cards": {"$in": card_ids}}, "$inc": {"candies": self.candies}})
-            await func.update_user(self.seller.id, seller_query)
+            await func.update_user(self.seller.id, seller_query, sync=True)
             
             # Buyer
             buyer_query = func.update_quest_progress(_buyer, "TRADE_ANY_CARD", progress=len(self.cards), query={"$push": {"cards": {"$each": card_ids}}, "$inc": {"candies": -self.candies}})
-            await func.update_user(buyer.id, buyer_query)
+            await func.update_user(buyer.id, buyer_query, sync=True)
             await func.update_card(card_ids, {"$set": {"owner_id": buyer.id, "last_trade_time": last_trade_time}})
             
             func.logger.info(